@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import random
+
+
+class SongGenerator(object):
+    """generates synthetic mmlx songs for benchmarking
+
+    length - number of lines for each voice
+    chips - any of 2A03, N106, VRC6 and FDS
+    voices - how many 2A03 (up to 3) and N106 (up to 8) voices to use
+    variables - number of note pattern variables
+    instruments - number of instruments for each chip
+    slides - chance of a note sliding into the next one (0 to 1)
+    magic - magic macro complexity from 0 (plain numbers) to 3 (nested repeats and curves)
+    """
+
+    NOTES = ['c', 'c+', 'd', 'd+', 'e', 'f', 'f+', 'g', 'g+', 'a', 'a+', 'b']
+    LENGTHS = ['4', '8', '8', '16', '16', '8.']
+    CURVES = ['easeInQuad', 'easeOutQuad', 'easeInOutCubic', 'easeOutQuart']
+
+    def __init__(self, length=16, chips=None, voices=3, variables=8, instruments=4, slides=0.05, magic=1, seed=1):
+        self.length = length
+        self.chips = chips if chips is not None else ['2A03']
+        self.voices = voices
+        self.variables = variables
+        self.instruments = instruments
+        self.slides = slides
+        self.magic = magic
+        self.random = random.Random(seed)
+
+    def getVoices(self, chip):
+        if chip == '2A03':
+            return list('ABC'[:min(self.voices, 3)])
+
+        if chip == 'N106':
+            return ['N106-' + voice for voice in 'ABCDEFGH'[:min(self.voices, 8)]]
+
+        if chip == 'VRC6':
+            return ['VRC6-A', 'VRC6-B', 'VRC6-C']
+
+        if chip == 'FDS':
+            return ['FDS-A']
+
+        raise Exception('unknown chip: ' + chip)
+
+    def getVolume(self, maximum):
+        top = self.random.randint(maximum // 2, maximum)
+        if self.magic == 0:
+            return ' '.join([str(max(top - x, 0)) for x in range(0, 8)])
+
+        if self.magic == 1:
+            return '0..' + str(top) + ' ' + str(top) + '..' + str(top // 3)
+
+        if self.magic == 2:
+            return '[' + str(top) + '..' + str(top // 2) + '].step(2).repeat(3) ' + str(top // 2) + '..0'
+
+        curve = self.random.choice(SongGenerator.CURVES)
+        return '[[0..' + str(top) + '].step(2)].repeat(2) 0..' + str(top) + ".curve('" + curve + "').step(.5)"
+
+    def getInstruments(self, chip):
+        lines = []
+        for x in range(0, self.instruments):
+            name = chip.lower() + '-' + str(x)
+            lines.append(name + ':')
+
+            if chip == '2A03':
+                lines.append('    volume: ' + self.getVolume(15))
+                lines.append('    timbre: ' + str(self.random.randint(0, 3)))
+                if x % 3 == 1:
+                    lines.append('    arpeggio: 0 4 7 0 4 7 0')
+
+                if x % 3 == 2:
+                    lines.append('    vibrato: 2 ' + str(self.random.randint(2, 6)) + ' 4')
+
+            if chip == 'N106':
+                lines.append('    chip: N106')
+                lines.append('    volume: ' + self.getVolume(15))
+                lines.append('    waveform: ' + ' '.join([str(self.random.randint(0, 15)) for y in range(0, 16)]))
+
+            if chip == 'VRC6':
+                lines.append('    chip: VRC6')
+                lines.append('    volume: ' + self.getVolume(15))
+
+            if chip == 'FDS':
+                lines.append('    chip: FDS')
+                lines.append('    volume: ' + self.getVolume(32))
+                lines.append('    waveform: ' + ' '.join([str(self.random.randint(0, 63)) for y in range(0, 64)]))
+
+            lines.append('')
+
+        # the vrc6 sawtooth does not support timbre so the squares get their own
+        if chip == 'VRC6':
+            lines.append('vrc6-square:')
+            lines.append('    timbre: ' + str(self.random.randint(0, 7)))
+            lines.append('')
+
+        return lines
+
+    def getVariables(self):
+        lines = []
+        for x in range(0, self.variables):
+            notes = [self.random.choice(SongGenerator.NOTES) for y in range(0, 4)]
+            lines.append('pattern' + str(x) + ' = ' + ' '.join(notes))
+
+        lines.append('')
+        return lines
+
+    def getNotes(self, count, slides=True):
+        words = []
+        for x in range(0, count):
+            if self.variables and self.random.random() < .1:
+                words.append('[pattern' + str(self.random.randint(0, self.variables - 1)) + ']2')
+                continue
+
+            words.append(self.random.choice(SongGenerator.NOTES) + self.random.choice(SongGenerator.LENGTHS))
+
+            if slides and x < count - 1 and self.random.random() < self.slides:
+                words.append('/' + self.random.choice(['8', '16']))
+                words.append(self.random.choice(SongGenerator.NOTES) + self.random.choice(SongGenerator.LENGTHS))
+
+        return words
+
+    def getVoiceLine(self, chip, voice, line):
+        words = [voice, 'o' + str(self.random.randint(4, 5))]
+
+        instrument = chip.lower() + '-' + str((line + len(voice)) % self.instruments)
+        words.append('@' + instrument)
+        if chip == 'VRC6' and voice != 'VRC6-C':
+            words.append('+@vrc6-square')
+
+        # slides in songs using the N106 take the waveform of the active
+        # instrument into account which only works for N106 waveforms
+        slides = chip != 'FDS'
+
+        words += self.getNotes(8, slides)
+        words.append(self.random.choice(['>', '<']))
+        words += self.getNotes(8, slides)
+        return ' '.join(words)
+
+    def generate(self):
+        lines = ['#TITLE Benchmark', '#COMPOSER mmlx', '#X-TEMPO 140', '']
+
+        for chip in self.chips:
+            lines += self.getInstruments(chip)
+
+        lines += self.getVariables()
+
+        for line in range(0, self.length):
+            for chip in self.chips:
+                for voice in self.getVoices(chip):
+                    lines.append(self.getVoiceLine(chip, voice, line))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""compiles mmlx from python without going through the command line
+
+    from mmlxlib.api import compile
+
+    result = compile(source, import_resolver=lambda filename: library[filename])
+    if result.succeeded():
+        print(result.mml)
+
+compile() never prints, never exits and keeps no state between calls so it is
+safe to call as many times as you like from a long running process.
+"""
+import os
+import shutil
+from .warpwhistle import WarpWhistle
+from .assembler import Assembler
+from .filecache import FileCache
+from .importer import Importer
+from .logger import BufferedLogger
+from .profiler import Profiler
+from .capture import Capture
+from .validator import Validator
+from .sizereport import SizeReport
+from .util import Util
+
+
+DEFAULT_OPTIONS = {
+    # path of the source file, used to find imports and dmc samples
+    'path': None,
+
+    # directories to look for imports in after the directory of the song
+    'import_path': [],
+
+    # also process each voice on its own (like --bob-omb)
+    'separate_voices': False,
+
+    # shorten macros without changing how they sound (like --compress-macros)
+    'compress_macros': False,
+
+    # process groups of voices in this many processes at once (like --parallel-voices)
+    'parallel_voices': None,
+
+    # directory to keep dmc samples converted from wav files in (like --dpcm-cache)
+    'dpcm_cache': None,
+
+    # run ppmckc and nesasm to get nsf data
+    'create_nsf': False,
+
+    # use the ppmckc and nesasm binaries that ship in the bin directory
+    'local': False,
+
+    # keep the verbose messages in the diagnostics
+    'verbose': False,
+
+    # time each stage and count what was processed (see Result.profile)
+    'profile': False,
+
+    # write a cProfile capture of the compile to this path
+    'profile_out': None,
+
+    # format of the capture, pstats or collapsed (for flamegraphs)
+    'profile_format': Capture.PSTATS,
+
+    # estimate the bytes of driver data for the song (see Result.size)
+    'size_report': False,
+
+    # add an error if the song takes up more bytes than this
+    'size_budget': None,
+
+    # validate the generated mml and add what is wrong with it to the diagnostics
+    'check': False
+}
+
+
+class Result(object):
+    """everything that came out of a compile"""
+
+    def __init__(self):
+        # mml for the whole song
+        self.mml = None
+
+        # nsf data for the whole song if create_nsf is set
+        self.nsf = None
+
+        # voice => mml for each voice if separate_voices is set
+        self.voices = {}
+
+        # voice => nsf data for each voice if separate_voices and create_nsf are set
+        self.voice_nsfs = {}
+
+        # list of dictionaries with a level ('info', 'warning' or 'error') and a
+        # message, diagnostics from the check option and ppmckc also have the
+        # line in the mml and the source_line in the song it came from (when
+        # it did not come from the header)
+        self.diagnostics = []
+
+        # stage times and counters if the profile option is set, see Profiler.toDict
+        self.profile = None
+
+        # estimated bytes for the whole song, each voice and each macro if the
+        # size_report or size_budget option is set, see SizeReport.toDict
+        self.size = None
+
+    def addDiagnostic(self, level, message, line=None, source_line=None):
+        diagnostic = {'level': level, 'message': message}
+        if line is not None:
+            diagnostic['line'] = line
+
+        if source_line is not None:
+            diagnostic['source_line'] = source_line
+
+        self.diagnostics.append(diagnostic)
+
+    def getErrors(self):
+        return [diagnostic['message'] for diagnostic in self.diagnostics if diagnostic['level'] == 'error']
+
+    def succeeded(self):
+        return len(self.getErrors()) == 0
+
+
+def getOptions(options):
+    final_options = DEFAULT_OPTIONS.copy()
+    if options is not None:
+        final_options.update(options)
+
+    # the rest of mmlx knows the source path as start
+    final_options['start'] = final_options['path'] or '.'
+    final_options['create_mml'] = True
+    return final_options
+
+
+class Compiler(object):
+    """compiles mmlx strings
+
+    a warm compiler keeps what it can between compiles: the contents of
+    imported files (until they change on disk), parsed instruments and a
+    workspace with a copy of the ppmck include files.  call close() when done
+    with it to remove the workspace.
+    """
+
+    # clear the instrument cache once it gets this big
+    MAX_CACHED_INSTRUMENTS = 4096
+
+    # and the compiled variable patterns once there are this many
+    MAX_CACHED_VARIABLE_PATTERNS = 4096
+
+    def __init__(self, warm=False):
+        self.warm = warm
+        self.file_cache = FileCache() if warm else None
+        self.instrument_cache = {} if warm else None
+        self.variable_patterns = {} if warm else None
+        self.importer = Importer(self.file_cache) if warm else None
+        self.workspace = None
+
+    def getAssembler(self, logger, options):
+        if not self.warm:
+            return Assembler(logger, options)
+
+        if self.workspace is None or not os.path.isdir(self.workspace):
+            self.workspace = Assembler(logger, options).createWorkspace()
+
+        return Assembler(logger, options, self.workspace)
+
+    def compileFile(self, path, options=None):
+        """compiles the mmlx file at path, imports are loaded relative to it"""
+        options = options.copy() if options is not None else {}
+        options['path'] = path
+
+        try:
+            source = self.file_cache.read(path) if self.warm else Util.openFile(path)
+        except (IOError, OSError) as e:
+            result = Result()
+            result.addDiagnostic('error', str(e))
+            return result
+
+        return self.compile(source, None, options)
+
+    def compile(self, source, import_resolver=None, options=None):
+        """compiles an mmlx string and returns a Result
+
+        import_resolver is called with the file name of every @import (with the
+        .mmlx extension added) and should return its contents.  without one
+        imports are read from the directory of options['path'] or the current
+        directory.
+        """
+        options = getOptions(options)
+        if options['profile_out'] is not None:
+            capture = Capture(options['profile_out'], options['profile_format'])
+            options['profile_out'] = None
+            return capture.run(self.compile, source, import_resolver, options)
+
+        logger = BufferedLogger(options)
+        result = Result()
+        whistle = None
+
+        try:
+            whistle = WarpWhistle(source, logger, options)
+            if options['path'] is not None:
+                whistle.import_directory = os.path.dirname(options['path'])
+
+            whistle.import_resolver = import_resolver
+            whistle.importer = self.importer
+
+            if self.instrument_cache is not None:
+                if len(self.instrument_cache) > Compiler.MAX_CACHED_INSTRUMENTS:
+                    self.instrument_cache.clear()
+
+                whistle.instrument_cache = self.instrument_cache
+
+            if self.variable_patterns is not None:
+                if len(self.variable_patterns) > Compiler.MAX_CACHED_VARIABLE_PATTERNS:
+                    self.variable_patterns.clear()
+
+                whistle.variable_patterns = self.variable_patterns
+
+            assembler = self.getAssembler(logger, options) if options['create_nsf'] else None
+
+            if options['profile']:
+                whistle.profiler = Profiler()
+                if assembler is not None:
+                    assembler.profiler = whistle.profiler
+
+            while whistle.isPlaying():
+                song = whistle.record()
+                emitter = song[0]
+                voice = song[1]
+
+                try:
+                    mml = emitter.getvalue()
+                    nsf = assembler.getNSFData(emitter) if assembler is not None else None
+                finally:
+                    emitter.close()
+
+                    # what ppmckc and nesasm said, with the line in the mml for ppmckc
+                    if assembler is not None:
+                        for diagnostic in assembler.diagnostics:
+                            result.addDiagnostic(diagnostic['level'], diagnostic['message'] if voice is None else 'voice ' + voice + ': ' + diagnostic['message'], diagnostic['line'], emitter.getSourceLine(diagnostic['line'] or 0))
+
+                if options['check']:
+                    for diagnostic in Validator().validate(mml):
+                        result.addDiagnostic(diagnostic['level'], diagnostic['message'] if voice is None else 'voice ' + voice + ': ' + diagnostic['message'], diagnostic['line'], emitter.getSourceLine(diagnostic['line'] or 0))
+
+                if voice is None and (options['size_report'] or options['size_budget'] is not None):
+                    report = SizeReport(mml)
+                    result.size = report.toDict()
+                    if report.isOverBudget(options['size_budget']):
+                        result.addDiagnostic('error', 'song is %d bytes which is over the budget of %d bytes' % (report.getTotal(), options['size_budget']))
+
+                if voice is None:
+                    result.mml = mml
+                    result.nsf = nsf
+                    continue
+
+                result.voices[voice] = mml
+                if nsf is not None:
+                    result.voice_nsfs[voice] = nsf
+
+        except Exception as e:
+            result.addDiagnostic('error', str(e))
+
+        if whistle is not None and whistle.profiler is not None:
+            whistle.profiler.close()
+            result.profile = whistle.profiler.toDict()
+
+        # whatever was logged along the way comes first
+        result.diagnostics = [{'level': 'info', 'message': message} for message in logger.messages if message] + result.diagnostics
+        return result
+
+    def close(self):
+        if self.workspace is not None:
+            shutil.rmtree(self.workspace, True)
+            self.workspace = None
+
+
+def compile(source, import_resolver=None, options=None):
+    """compiles an mmlx string and returns a Result, see Compiler.compile"""
+    return Compiler().compile(source, import_resolver, options)
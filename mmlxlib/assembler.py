@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from timeit import default_timer
+from .util import Util
+from .tooloutput import ToolOutput
+
+
+class Assembler(object):
+    """builds nsf files from mml using ppmckc and nesasm
+
+    every build happens in its own scratch directory so the intermediate mml
+    and the files ppmckc generates (define.inc, effect.h, song.h) never show up
+    next to the song.  the only thing written to the destination is the nsf.
+    """
+
+    # prefer a memory backed file system for the scratch directories
+    SCRATCH_PARENTS = ['/dev/shm']
+
+    # how often a running command checks if the build should be cancelled
+    POLL_INTERVAL = .05
+
+    def __init__(self, logger, options, workspace=None):
+        self.logger = logger
+        self.options = options
+
+        # a workspace that is kept between builds (see Compiler), by default
+        # every build gets a new one
+        self.workspace = workspace
+
+        # set to a Profiler to record how long ppmckc and nesasm take
+        self.profiler = None
+
+        # set to a function returning True to stop ppmckc or nesasm in the
+        # middle of a build (when watching and the song is saved again)
+        self.should_cancel = None
+
+        # what ppmckc and nesasm reported for the last song, see ToolOutput
+        self.diagnostics = []
+
+        # command => seconds spent running it for every song built
+        self.durations = {}
+
+    def getScratchParent(self):
+        for path in Assembler.SCRATCH_PARENTS:
+            if os.path.isdir(path) and os.access(path, os.W_OK):
+                return path
+
+        # let tempfile figure it out
+        return None
+
+    def getIncludePath(self):
+        return os.path.join(os.path.dirname(__file__), 'nes_include')
+
+    def getCommand(self, name):
+        if not self.options['local']:
+            return name
+
+        return os.path.join(os.path.dirname(__file__), '..', 'bin', name)
+
+    def createWorkspace(self):
+        workspace = tempfile.mkdtemp(prefix='mmlx-', dir=self.getScratchParent())
+
+        # nesasm writes the nsf into the include directory so we need our own copy
+        shutil.copytree(self.getIncludePath(), os.path.join(workspace, 'nes_include'))
+        return workspace
+
+    def getWorkspace(self):
+        if self.workspace is None:
+            return self.createWorkspace()
+
+        return self.workspace
+
+    def releaseWorkspace(self, workspace):
+        if workspace != self.workspace:
+            shutil.rmtree(workspace, True)
+            return
+
+        # keep the nes include copy around for the next build
+        for name in os.listdir(workspace):
+            path = os.path.join(workspace, name)
+            if name == 'nes_include':
+                continue
+
+            if os.path.isdir(path):
+                shutil.rmtree(path, True)
+            else:
+                os.unlink(path)
+
+        nsf_path = os.path.join(workspace, 'nes_include', 'ppmck.nes')
+        if os.path.isfile(nsf_path):
+            os.unlink(nsf_path)
+
+    def run(self, command, workspace, mml_path=None):
+        """runs a command and returns a ToolOutput with what it printed"""
+        env = os.environ.copy()
+        env['NES_INCLUDE'] = os.path.join(workspace, 'nes_include')
+
+        started = default_timer()
+        if self.should_cancel is None:
+            process = subprocess.Popen(command, cwd=workspace, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+        else:
+            process, output = self.runCancellable(command, workspace, env)
+
+        seconds = default_timer() - started
+        name = os.path.basename(command[0])
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.logger.debug('- %s took %.2fms', name, seconds * 1000)
+
+        if self.profiler is not None:
+            self.profiler.addTime(name, seconds)
+
+        # the messages we look for are ascii, latin-1 keeps anything else from failing to decode
+        result = ToolOutput(command, process.returncode, output.decode('latin-1'), seconds, mml_path)
+        self.diagnostics += result.diagnostics
+        return result
+
+    def runCancellable(self, command, workspace, env):
+        """runs a command and kills it as soon as should_cancel returns True,
+        returns the process and what it printed"""
+        # output goes to a file so a full pipe can't block the command while we poll
+        output = tempfile.TemporaryFile()
+        try:
+            process = subprocess.Popen(command, cwd=workspace, env=env, stdout=output, stderr=subprocess.STDOUT)
+            while process.poll() is None:
+                if self.should_cancel():
+                    process.kill()
+                    process.wait()
+                    raise Exception('build cancelled')
+
+                time.sleep(Assembler.POLL_INTERVAL)
+
+            output.seek(0)
+            return (process, output.read())
+        finally:
+            output.close()
+
+    def assemble(self, mml, name, workspace):
+        """runs ppmckc and nesasm on mml (a string or an emitter) and returns the path of the nsf"""
+        mml_path = os.path.join(workspace, name.replace('.nsf', '.mml'))
+        Util.writeFile(mml_path, mml, False)
+        self.diagnostics = []
+
+        # nesasm would only trip over whatever ppmckc left behind
+        output = self.run([self.getCommand('ppmckc'), '-m1', '-i', mml_path], workspace, mml_path)
+        if not output.failed():
+            output = self.run([self.getCommand('nesasm'), '-s', '-raw', os.path.join(workspace, 'nes_include', 'ppmck.asm')], workspace)
+
+        nsf_path = os.path.join(workspace, 'nes_include', 'ppmck.nes')
+        if output.failed():
+            raise Exception('failed to create NSF file! ' + output.getSummary())
+
+        if not os.path.isfile(nsf_path):
+            self.logger.log('')
+            raise Exception('failed to create NSF file! Your MML is probably invalid.')
+
+        return nsf_path
+
+    def createNSF(self, mml, nsf_path):
+        """assembles mml and moves the nsf to nsf_path"""
+        self.logger.log('generating file: ' + self.logger.color(nsf_path, self.logger.YELLOW))
+
+        workspace = self.getWorkspace()
+        try:
+            nsf_scratch_path = self.assemble(mml, os.path.basename(nsf_path), workspace)
+            if not Util.moveFile(nsf_scratch_path, nsf_path):
+                self.logger.debug('- nsf is unchanged: %s', nsf_path)
+        finally:
+            self.releaseWorkspace(workspace)
+
+    def getNSFData(self, mml, name='song.nsf'):
+        """assembles mml and returns the contents of the nsf"""
+        workspace = self.getWorkspace()
+        try:
+            file = open(self.assemble(mml, name, workspace), 'rb')
+            data = file.read()
+            file.close()
+            return data
+        finally:
+            self.releaseWorkspace(workspace)
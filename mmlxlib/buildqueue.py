@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class BuildQueue(object):
+    """songs waiting to be built while watching
+
+    a song that is added again before it is built is only built once, and the
+    song saved most recently is built first since that is the one being
+    listened to.  songs saved at the same time are built in the order they
+    were added."""
+
+    def __init__(self):
+        # path => (modified time, order added, arguments for the build)
+        self.songs = {}
+        self.added = 0
+
+    def add(self, path, modified_time, arguments):
+        order = self.songs[path][1] if path in self.songs else self.added
+        self.songs[path] = (modified_time, order, arguments)
+        self.added += 1
+
+    def pop(self):
+        """returns the arguments for the song to build next"""
+        path = max(self.songs, key=lambda path: (self.songs[path][0], -self.songs[path][1]))
+        return self.songs.pop(path)[2]
+
+    def __len__(self):
+        return len(self.songs)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import sys
+from timeit import default_timer
+from .util import Util
+
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+
+
+class Capture(object):
+    """captures a python profile of everything a call does and writes it to a file
+
+    the pstats format can be opened with pstats, snakeviz and friends.  the
+    collapsed format has one line per call stack followed by the microseconds
+    spent in it which is what flamegraph.pl and speedscope expect.
+    """
+
+    PSTATS = 'pstats'
+    COLLAPSED = 'collapsed'
+
+    FORMATS = [PSTATS, COLLAPSED]
+
+    def __init__(self, path, format=PSTATS):
+        if not format in Capture.FORMATS:
+            raise Exception('unknown profile format ' + format + ', use one of ' + ', '.join(Capture.FORMATS))
+
+        self.path = path
+        self.format = format
+
+        # stack => seconds spent in the last function of the stack
+        self.stacks = {}
+        self.stack = []
+        self.last_event = None
+
+    @staticmethod
+    def getPathFor(path, name, root=None):
+        """path for the profile of one song when profiling a directory (profile.prof => profile.song.prof)
+
+        songs in directories inside root keep those directories in the name
+        (profile.sub.song.prof) so songs with the same name don't overwrite
+        each other's profile"""
+        name = os.path.relpath(name, root) if root is not None else os.path.basename(name)
+        bits = os.path.splitext(path)
+        return bits[0] + '.' + os.path.splitext(name)[0].replace(os.sep, '.') + bits[1]
+
+    def run(self, callback, *args):
+        if self.format == Capture.COLLAPSED:
+            return self.runCollapsed(callback, args)
+
+        profiler = profile.Profile()
+        try:
+            return profiler.runcall(callback, *args)
+        finally:
+            profiler.dump_stats(self.path)
+
+    def runCollapsed(self, callback, args):
+        previous = sys.getprofile()
+        self.last_event = default_timer()
+        sys.setprofile(self.trace)
+        try:
+            return callback(*args)
+        finally:
+            sys.setprofile(previous)
+            self.addTime()
+            Util.writeFile(self.path, ''.join(self.renderLines()))
+
+    def getFrameName(self, frame):
+        code = frame.f_code
+        return os.path.basename(code.co_filename) + ':' + code.co_name
+
+    def addTime(self):
+        now = default_timer()
+        if len(self.stack):
+            key = ';'.join(self.stack)
+            self.stacks[key] = self.stacks.get(key, 0.0) + now - self.last_event
+
+        self.last_event = now
+
+    def trace(self, frame, event, arg):
+        self.addTime()
+
+        if event == 'call':
+            self.stack.append(self.getFrameName(frame))
+        elif event == 'c_call':
+            self.stack.append(getattr(arg, '__name__', 'builtin'))
+        elif event in ('return', 'c_return', 'c_exception') and len(self.stack):
+            self.stack.pop()
+
+    def renderLines(self):
+        lines = []
+        for stack in sorted(self.stacks):
+            microseconds = int(round(self.stacks[stack] * 1000000))
+            if microseconds > 0:
+                lines.append(stack + ' ' + str(microseconds) + '\n')
+
+        return lines
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2012 Craig Campbell
 #
@@ -65,6 +65,8 @@
 
 
 class Curve(object):
+    __slots__ = ('begin', 'end', 'change', 'duration')
+
     def __init__(self, begin, end, duration):
         self.begin = begin
         self.end = end
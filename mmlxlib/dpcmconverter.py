@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import io
+import os
+import struct
+import wave
+from .util import Util
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class DPCMConverter(object):
+    """turns wav files into dmc samples for dpcm declarations
+
+    the wav is mixed down to one channel, resampled to the rate the sample is
+    played at and delta encoded: every bit moves the 7 bit output level up or
+    down by 2.  samples are padded to 16 * n + 1 bytes since that is the only
+    length the hardware can play.  converted samples are kept in a cache
+    directory under a hash of the wav and the rate so a sample is only
+    encoded again when it changes.  numpy does the decoding and resampling
+    when it is installed, the results are the same without it.
+    """
+
+    # playback rate in hz for each of the 16 rates (ntsc)
+    RATES = [4181.71, 4709.93, 5264.04, 5593.04, 6257.95, 7046.35, 7919.35, 8363.42,
+             9419.86, 11186.1, 12604.0, 13982.6, 16884.6, 21306.8, 24858.0, 33143.9]
+
+    # rate used when the declaration does not have one
+    DEFAULT_RATE = 15
+
+    # the length register goes up to 255 so this is the longest sample there is
+    MAX_BYTES = 16 * 255 + 1
+
+    # the output level the encoder starts at (the middle of 0 - 127)
+    START_LEVEL = 64
+
+    # going up and down keeps the level where it is
+    PADDING = 0x55
+
+    # change this when the encoding changes so samples in the cache are encoded again
+    VERSION = 1
+
+    # bytes per sample => value of a full scale sample
+    FULL_SCALE = {1: 128.0, 2: 32768.0, 3: 8388608.0, 4: 2147483648.0}
+
+    def __init__(self, cache_directory=None, logger=None):
+        self.cache_directory = cache_directory or DPCMConverter.getDefaultCacheDirectory()
+        self.logger = logger
+
+        # how many samples were encoded and how many came from the cache
+        self.converted = 0
+        self.cached = 0
+
+    @staticmethod
+    def getDefaultCacheDirectory():
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(cache_home, 'mmlx', 'dpcm')
+
+    def getCachePath(self, data, rate):
+        digest = hashlib.sha1(data)
+        digest.update(f':{DPCMConverter.VERSION}:{rate}'.encode('ascii'))
+        return os.path.join(self.cache_directory, digest.hexdigest() + '.dmc')
+
+    def convert(self, path, rate=None):
+        """returns the path of the dmc sample for the wav at path"""
+        if rate is None:
+            rate = DPCMConverter.DEFAULT_RATE
+
+        if rate < 0 or rate >= len(DPCMConverter.RATES):
+            raise Exception('dpcm rate for ' + path + ' has to be between 0 and 15')
+
+        try:
+            file = open(path, 'rb')
+            data = file.read()
+            file.close()
+        except IOError:
+            raise Exception('dpcm sample not found: ' + path)
+
+        cache_path = self.getCachePath(data, rate)
+        if os.path.isfile(cache_path):
+            self.cached += 1
+            return cache_path
+
+        if not os.path.isdir(self.cache_directory):
+            os.makedirs(self.cache_directory)
+
+        sample = self.encode(data, rate, path)
+        temp_path = Util.createTempFileFor(cache_path)
+        try:
+            file = open(temp_path, 'wb')
+            file.write(sample)
+        except:
+            os.unlink(temp_path)
+            raise
+
+        Util.replaceFile(temp_path, cache_path, file)
+        self.converted += 1
+
+        if self.logger is not None:
+            self.logger.debug('- converted %s to %d bytes of dpcm', path, len(sample))
+
+        return cache_path
+
+    def readWav(self, data, path):
+        """returns the pcm data, sample width, channel count and rate of a wav file"""
+        try:
+            wav = wave.open(io.BytesIO(data), 'rb')
+        except (wave.Error, EOFError) as e:
+            raise Exception(path + ' is not a pcm wav file: ' + str(e))
+
+        try:
+            return (wav.readframes(wav.getnframes()), wav.getsampwidth(), wav.getnchannels(), wav.getframerate())
+        finally:
+            wav.close()
+
+    def getLevels(self, frames, width, channels, rate, target_rate):
+        """mixes the wav down to one channel and resamples it to target_rate as output levels from 0 to 127"""
+        if numpy is not None:
+            return self.getLevelsWithNumpy(frames, width, channels, rate, target_rate)
+
+        count = len(frames) // width
+        if width == 1:
+            samples = [float(value) - 128.0 for value in frames[:count]]
+        elif width == 3:
+            samples = [float(int.from_bytes(frames[key:key + 3], 'little', signed=True)) for key in range(0, count * 3, 3)]
+        else:
+            samples = [float(value) for value in struct.unpack('<%d%s' % (count, 'h' if width == 2 else 'i'), frames[:count * width])]
+
+        frame_count = count // channels
+        scale = channels * DPCMConverter.FULL_SCALE[width]
+        mixed = []
+        for key in range(frame_count):
+            total = samples[key * channels]
+            for channel in range(1, channels):
+                total += samples[key * channels + channel]
+
+            mixed.append((total / scale + 1.0) * 63.5)
+
+        step = rate / target_rate
+        levels = []
+        for key in range(int(frame_count / step)):
+            position = key * step
+            index = int(position)
+            left = mixed[index]
+            right = mixed[min(index + 1, frame_count - 1)]
+            levels.append(left + (right - left) * (position - index))
+
+        return levels
+
+    def getLevelsWithNumpy(self, frames, width, channels, rate, target_rate):
+        count = len(frames) // width
+        if width == 1:
+            samples = numpy.frombuffer(frames, numpy.uint8, count).astype(numpy.float64) - 128.0
+        elif width == 3:
+            parts = numpy.frombuffer(frames, numpy.uint8, count * 3).reshape(count, 3).astype(numpy.int32)
+            values = parts[:, 0] | (parts[:, 1] << 8) | (parts[:, 2] << 16)
+            samples = numpy.where(values >= 0x800000, values - 0x1000000, values).astype(numpy.float64)
+        else:
+            samples = numpy.frombuffer(frames, '<i2' if width == 2 else '<i4', count).astype(numpy.float64)
+
+        frame_count = count // channels
+        samples = samples[:frame_count * channels].reshape(frame_count, channels)
+
+        # channels are added one at a time so the sums come out the same as without numpy
+        total = samples[:, 0].copy()
+        for channel in range(1, channels):
+            total += samples[:, channel]
+
+        mixed = (total / (channels * DPCMConverter.FULL_SCALE[width]) + 1.0) * 63.5
+
+        step = rate / target_rate
+        positions = numpy.arange(int(frame_count / step), dtype=numpy.float64) * step
+        indexes = positions.astype(numpy.int64)
+        left = mixed[indexes]
+        right = mixed[numpy.minimum(indexes + 1, frame_count - 1)]
+        return left + (right - left) * (positions - indexes)
+
+    def getBits(self, levels):
+        """delta encodes the levels, 1 moves the output up and 0 moves it down"""
+        bits = bytearray(len(levels))
+        level = DPCMConverter.START_LEVEL
+        for key, target in enumerate(levels):
+            if target > level:
+                bits[key] = 1
+                if level <= 125:
+                    level += 2
+            elif level >= 2:
+                level -= 2
+
+        return bits
+
+    def packBits(self, bits):
+        """puts 8 bits in each byte starting from the lowest bit"""
+        if numpy is not None:
+            return numpy.packbits(numpy.frombuffer(bytes(bits), numpy.uint8), bitorder='little').tobytes()
+
+        packed = bytearray((len(bits) + 7) // 8)
+        for key, bit in enumerate(bits):
+            if bit:
+                packed[key >> 3] |= 1 << (key & 7)
+
+        return bytes(packed)
+
+    def encode(self, data, rate, path='sample.wav'):
+        """returns the dmc sample for the contents of a wav file"""
+        frames, width, channels, wav_rate = self.readWav(data, path)
+        if not width in DPCMConverter.FULL_SCALE:
+            raise Exception(path + ' has samples that are ' + str(width) + ' bytes, only 1 to 4 are supported')
+
+        sample = self.packBits(self.getBits(self.getLevels(frames, width, channels, wav_rate, DPCMConverter.RATES[rate])))
+
+        if len(sample) > DPCMConverter.MAX_BYTES:
+            if self.logger is not None:
+                self.logger.warning('%s is too long for a dpcm sample at rate %d, it is cut off after %d bytes', path, rate, DPCMConverter.MAX_BYTES)
+            sample = sample[:DPCMConverter.MAX_BYTES]
+
+        # lengths have to be 16 * n + 1
+        length = (len(sample) + 14) // 16 * 16 + 1
+        return sample + bytes([DPCMConverter.PADDING]) * (length - len(sample))
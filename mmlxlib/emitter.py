@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+import tempfile
+
+
+class Emitter(object):
+    """collects generated mml in separate sections and writes them out in order
+
+    the header sections are small so they are kept as lists of lines.  the body
+    can be huge so it goes into a spooled file that stays in memory until it
+    gets too big and then moves to disk.
+    """
+
+    # everything up to and including the last global declaration in the source
+    PREAMBLE = 'preamble'
+
+    # global declarations added while rendering (#EX-NAMCO106, #PITCH-CORRECTION, etc)
+    GLOBALS = 'globals'
+
+    # macro tables rendered from instruments
+    MACROS = 'macros'
+
+    # tempo line for all voices from X-TEMPO
+    TEMPO = 'tempo'
+
+    # everything else
+    BODY = 'body'
+
+    SECTIONS = [PREAMBLE, GLOBALS, MACROS, TEMPO, BODY]
+
+    # how much of the body we keep in memory before spilling to disk
+    MAX_BODY_MEMORY = 4 * 1024 * 1024
+
+    __slots__ = ('sections', 'body', 'sources')
+
+    def __init__(self):
+        self.sections = {}
+
+        # line in the source each line came from (0 if it was generated)
+        self.sources = {}
+        for section in Emitter.SECTIONS:
+            self.sections[section] = []
+            self.sources[section] = array.array('q')
+
+        self.body = tempfile.SpooledTemporaryFile(max_size=Emitter.MAX_BODY_MEMORY, mode='w+')
+
+    def addLine(self, section, line, source=0):
+        if '\n' in line:
+            self.sources[section].extend([source] * (line.count('\n') + 1))
+        else:
+            self.sources[section].append(source)
+
+        if section == Emitter.BODY:
+            self.body.write(line + '\n')
+            return
+
+        self.sections[section].append(line + '\n')
+
+    def addLines(self, section, lines):
+        for line in lines:
+            self.addLine(section, line)
+
+    def getSourceLine(self, line):
+        """returns the line in the source that line of the mml (starting at 1)
+        came from, or None if it was generated"""
+        if line < 1:
+            return None
+
+        line -= 1
+        for section in Emitter.SECTIONS:
+            sources = self.sources[section]
+            if line < len(sources):
+                return sources[line] or None
+
+            line -= len(sources)
+
+        return None
+
+    def hasLines(self, section):
+        if section == Emitter.BODY:
+            return self.body.tell() > 0
+
+        return len(self.sections[section]) > 0
+
+    def writeTo(self, stream):
+        for section in Emitter.SECTIONS:
+            if section != Emitter.BODY:
+                stream.write(''.join(self.sections[section]))
+                continue
+
+            self.body.seek(0)
+            while True:
+                chunk = self.body.read(65536)
+                if not chunk:
+                    break
+
+                stream.write(chunk)
+
+            # leave the position at the end so more lines can be added
+            self.body.seek(0, 2)
+
+    def getvalue(self):
+        bits = []
+        for section in Emitter.SECTIONS:
+            if section != Emitter.BODY:
+                bits += self.sections[section]
+                continue
+
+            self.body.seek(0)
+            bits.append(self.body.read())
+            self.body.seek(0, 2)
+
+        return ''.join(bits)
+
+    def close(self):
+        self.body.close()
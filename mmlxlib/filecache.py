@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import mmap
+import os
+import re
+import stat
+from .util import Util
+
+
+class FileCache(object):
+    """keeps the contents of files in memory and reads them again when they change on disk
+
+    the same string is handed out to everyone reading a file so a library
+    imported by a hundred songs is only in memory once.
+
+    during a build (between startBuild and finishBuild) every file is only
+    stat'ed once.  scan() stats a whole directory at once up front so the
+    songs in it and the files they import don't need a stat of their own.
+    """
+
+    # files bigger than this are read through mmap
+    MMAP_THRESHOLD = 256 * 1024
+
+    # \r\n or \r on its own
+    LINE_ENDING = re.compile(r'\r\n?')
+
+    def __init__(self):
+        # absolute path => ((mtime, size), content)
+        self.files = {}
+
+        # absolute path => (mtime, size) or None if it doesn't exist, only
+        # kept during a build
+        self.signatures = None
+
+    def startBuild(self):
+        self.signatures = {}
+
+    def finishBuild(self):
+        self.signatures = None
+
+    def stat(self, path):
+        try:
+            result = os.stat(path)
+        except OSError:
+            return None
+
+        # directories don't count
+        if not stat.S_ISREG(result.st_mode):
+            return None
+
+        return (result.st_mtime, result.st_size)
+
+    def getSignature(self, path):
+        path = os.path.abspath(path)
+        if self.signatures is None:
+            return self.stat(path)
+
+        if not path in self.signatures:
+            self.signatures[path] = self.stat(path)
+
+        return self.signatures[path]
+
+    def isFile(self, path):
+        return self.getSignature(path) is not None
+
+    def getModifiedTime(self, path):
+        return self.getSignature(path)[0]
+
+    def scan(self, directory, extension='mmlx', recursive=False, skip_directory=None):
+        """returns the paths of the files in directory ending in extension and remembers their signatures for this build
+
+        with recursive the directories inside are scanned too, except for
+        symlinks and directories skip_directory returns True for."""
+        paths = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            try:
+                result = os.stat(path)
+            except OSError:
+                continue
+
+            if stat.S_ISDIR(result.st_mode):
+                if recursive and not os.path.islink(path) and (skip_directory is None or not skip_directory(path)):
+                    paths += self.scan(path, extension, True, skip_directory)
+                continue
+
+            if not stat.S_ISREG(result.st_mode):
+                continue
+
+            if self.signatures is not None:
+                self.signatures[os.path.abspath(path)] = (result.st_mtime, result.st_size)
+
+            if name.endswith('.' + extension):
+                paths.append(path)
+
+        return paths
+
+    def load(self, path, size):
+        if size < FileCache.MMAP_THRESHOLD:
+            return Util.openFile(path)
+
+        file = open(path, 'rb')
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # decoded straight from the mapping without copying the bytes first
+                content = str(data, 'utf-8')
+            finally:
+                data.close()
+        finally:
+            file.close()
+
+        # read the same way a file opened as text is, with \r\n turned into \n
+        if '\r' in content:
+            content = FileCache.LINE_ENDING.sub('\n', content)
+
+        return content
+
+    def read(self, path):
+        path = os.path.abspath(path)
+        signature = self.getSignature(path)
+        if signature is None:
+            raise IOError('No such file: ' + path)
+
+        if path in self.files and self.files[path][0] == signature:
+            return self.files[path][1]
+
+        content = self.load(path, signature[1])
+        self.files[path] = (signature, content)
+        return content
+
+    def forget(self, path):
+        path = os.path.abspath(path)
+        if path in self.files:
+            del self.files[path]
+
+        if self.signatures is not None and path in self.signatures:
+            del self.signatures[path]
+
+    def clear(self):
+        self.files = {}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import re
+from .util import Util
+
+
+class Importer(object):
+    """resolves @import lines
+
+    an import is looked for next to the file that imports it, then next to the
+    song and then in each directory of the import path.  a file that has an
+    @once line is only included the first time it is imported.
+
+    every file is read and stripped of comments once per compile.  an importer
+    with a file cache can be kept between compiles (when watching or serving)
+    and only reads and strips files again when they change on disk.
+    """
+
+    IMPORT_LINE = re.compile(r'@import\s{1,}(\'|\")(.*)(\1)$', re.MULTILINE)
+    ONCE_LINE = re.compile(r'^@once\s*$', re.MULTILINE)
+
+    def __init__(self, file_cache=None):
+        self.file_cache = file_cache
+
+        # path => (content as read, content stripped of comments)
+        self.parsed = {}
+
+    def read(self, path):
+        if self.file_cache is not None:
+            return self.file_cache.read(path)
+
+        return Util.openFile(path)
+
+    def parse(self, content, whistle):
+        return whistle.stripComments(content)
+
+    def isFile(self, path):
+        if self.file_cache is not None:
+            return self.file_cache.isFile(path)
+
+        return os.path.isfile(path)
+
+    def findImport(self, filename, directories):
+        for directory in directories:
+            path = os.path.normpath(os.path.join(directory, filename))
+            if self.isFile(path):
+                return path
+
+        raise Exception('could not find import "' + filename + '" (looked in ' + ', '.join(directories) + ')')
+
+    def load(self, path, whistle):
+        """returns the stripped content of path, only stripping again if it changed"""
+        content = self.read(path)
+        if path in self.parsed and self.parsed[path][0] == content:
+            return self.parsed[path][1]
+
+        stripped = self.parse(content, whistle)
+        self.parsed[path] = (content, stripped)
+        return stripped
+
+    def getDirectories(self, whistle, directory):
+        directories = [] if directory is None else [directory]
+        for path in [whistle.import_directory] + whistle.import_path:
+            if not path in directories:
+                directories.append(path)
+
+        return directories
+
+    def getName(self, path):
+        return os.path.relpath(path) if os.path.isabs(path) else path
+
+    def resolve(self, content, whistle, line_map=None):
+        """returns content with every @import replaced by the file it imports,
+        the lines of an imported file are on the line of its @import in line_map"""
+        stack = []
+        if os.path.isfile(whistle.options.get('start') or ''):
+            stack.append(os.path.normpath(whistle.options['start']))
+
+        # loaded is path => content for this compile, included is every path
+        # included so far for @once
+        return self.process(content, whistle, None, stack, {}, set(), line_map)
+
+    def process(self, content, whistle, directory, stack, loaded, included, line_map=None):
+        def replace(match):
+            filename = match.group(2) if match.group(2).endswith('.mmlx') else match.group(2) + '.mmlx'
+
+            # a resolver (from the api) knows files by name only
+            if whistle.import_resolver is not None:
+                path = filename
+            else:
+                path = self.findImport(filename, self.getDirectories(whistle, directory))
+
+            if path in stack:
+                chain = [self.getName(item) for item in stack[stack.index(path):]] + [self.getName(path)]
+                raise Exception('circular import: ' + ' -> '.join(chain))
+
+            if not path in loaded:
+                if whistle.import_resolver is not None:
+                    loaded[path] = self.parse(whistle.import_resolver(path), whistle)
+                else:
+                    loaded[path] = self.load(path, whistle)
+
+            file_content = loaded[path]
+            if Importer.ONCE_LINE.search(file_content):
+                if path in included:
+                    return ''
+
+                file_content = Importer.ONCE_LINE.sub('', file_content)
+
+            included.add(path)
+
+            if file_content.find('@import') >= 0:
+                stack.append(path)
+                file_content = self.process(file_content, whistle, None if whistle.import_resolver is not None else os.path.dirname(path), stack, loaded, included)
+                stack.pop()
+
+            return file_content.strip('\n')
+
+        return whistle.substitute(Importer.IMPORT_LINE, replace, content, line_map)
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2012 Craig Campbell
 #
@@ -13,15 +13,18 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from util import Util
-from magicmacro import MagicMacro
+from .magicmacro import MagicMacro
 import math
 import re
 
 
 class Instrument(object):
 
-    def __init__(self, data):
+    # magic macros like [15 10].repeat(2) and 15..0.curve()
+    BRACKET_OBJECT = re.compile(r'(\[(.*)\]((\.[a-zA-Z]{1}.*?\))+))')
+    MAGIC_OBJECT = re.compile(r'((.*?)((\.[a-zA-Z]{1}.*?\))+))')
+
+    def __init__(self, data, macros=None):
         valid_chips = ['N106', 'FDS', 'VRC6']
 
         for key in data:
@@ -36,8 +39,12 @@ class Instrument(object):
         if hasattr(self, 'volume'):
             self.volume = self.magicMacro(self.volume)
 
+        if macros is not None:
+            self.registerBuffer(macros)
+
+    def registerBuffer(self, macros):
         if self.getChip() == 'N106':
-            Instrument.N106_buffers[self.waveform] = int(self.buffer) if hasattr(self, 'buffer') else None
+            macros.setBufferForWaveform(self.waveform, int(self.buffer) if hasattr(self, 'buffer') else None)
 
     # attack - time taken for amplitude to rise from 0 to max (15)
     # decay - time taken for amplitude to drop to sustain level
@@ -128,7 +135,7 @@ class Instrument(object):
 
             pos += 1
 
-        return re.match(r'(\[(.*)\]((\.[a-zA-Z]{1}.*?\))+))', macro[start_pos:pos])
+        return Instrument.BRACKET_OBJECT.match(macro[start_pos:pos])
 
     def magicMacroObjects(self, macro):
         # bracket objects
@@ -138,7 +145,7 @@ class Instrument(object):
         if not match:
             original = False
             # no bracket
-            match = re.match(r'((.*?)((\.[a-zA-Z]{1}.*?\))+))', macro)
+            match = Instrument.MAGIC_OBJECT.match(macro)
 
         if match:
             # print 'MACRO',macro
@@ -171,29 +178,6 @@ class Instrument(object):
 
         return None
 
-    @staticmethod
-    def reset(counter=0):
-        counter = int(counter)
-
-        Instrument.counters = {
-            'timbre': counter,
-            'volume': counter,
-            'pitch': counter,
-            'arpeggio': counter,
-            'vibrato': counter,
-            'N106': counter,
-            'FDS': counter
-        }
-
-        Instrument.timbres = {}
-        Instrument.volumes = {}
-        Instrument.pitches = {}
-        Instrument.arpeggios = {}
-        Instrument.vibratos = {}
-        Instrument.N106 = {}
-        Instrument.N106_buffers = {}
-        Instrument.FDS = {}
-
     def hasParent(self):
         return hasattr(self, 'extends') and self.extends is not None
 
@@ -209,89 +193,26 @@ class Instrument(object):
     def getParent(self):
         return self.extends
 
-    def getCountFor(self, macro):
-        i = Instrument.counters[macro]
-        Instrument.counters[macro] += 1
-        return i
-
-    def getVolumeMacro(self):
-        i = Instrument.volumes[self.volume] if self.volume in Instrument.volumes else self.getCountFor('volume')
-        Instrument.volumes[self.volume] = i
-        return '@v' + str(i)
-
-    def getPitchMacro(self):
-        i = Instrument.pitches[self.pitch] if self.pitch in Instrument.pitches else self.getCountFor('pitch')
-        Instrument.pitches[self.pitch] = i
-        return 'EP' + str(i)
-
-    def getArpeggioMacro(self):
-        i = Instrument.arpeggios[self.arpeggio] if self.arpeggio in Instrument.arpeggios else self.getCountFor('arpeggio')
-        Instrument.arpeggios[self.arpeggio] = i
-        return 'EN' + str(i)
-
-    def getTimbreMacro(self):
-        i = Instrument.timbres[self.timbre] if self.timbre in Instrument.timbres else self.getCountFor('timbre')
-        Instrument.timbres[self.timbre] = i
-        return '@@' + str(i)
-
-    def getVibratoMacro(self):
-        i = Instrument.vibratos[self.vibrato] if self.vibrato in Instrument.vibratos else self.getCountFor('vibrato')
-        Instrument.vibratos[self.vibrato] = i
-        return 'MP' + str(i)
-
-    def getN106Macro(self):
-        i = Instrument.N106[self.waveform] if self.waveform in Instrument.N106 else self.getCountFor('N106')
-        Instrument.N106[self.waveform] = i
-        return '@@' + str(i)
-
-    def getFDSMacro(self):
-        i = Instrument.FDS[self.waveform] if self.waveform in Instrument.FDS else self.getCountFor('FDS')
-        Instrument.FDS[self.waveform] = i
-        return '@@' + str(i)
-
-    @staticmethod
-    def hasBeenUsed():
-        macros = ["timbres", "volumes", "pitches", "arpeggios", "vibratos", "N106", "FDS"]
-        for macro in macros:
-            if len(getattr(Instrument, macro)) > 0:
-                return True
-
-        return False
-
-    @staticmethod
-    def render():
-        macros = ''
-
-        # render timbres
-        for timbre in Util.sortDictionary(Instrument.timbres):
-            macros += '@' + str(timbre[1]) + ' = { ' + timbre[0] + ' }\n'
+    def getVolumeMacro(self, macros):
+        return f"@v{macros.getNumberFor('volumes', self.volume)}"
 
-        # render volumes
-        for volume in Util.sortDictionary(Instrument.volumes):
-            macros += '@v' + str(volume[1]) + ' = { ' + volume[0] + ' }\n'
+    def getPitchMacro(self, macros):
+        return f"EP{macros.getNumberFor('pitches', self.pitch)}"
 
-        # render pitches
-        for pitch in Util.sortDictionary(Instrument.pitches):
-            macros += '@EP' + str(pitch[1]) + ' = { ' + pitch[0] + ' }\n'
+    def getArpeggioMacro(self, macros):
+        return f"EN{macros.getNumberFor('arpeggios', self.arpeggio)}"
 
-        # render arpeggios
-        for arpeggio in Util.sortDictionary(Instrument.arpeggios):
-            macros += '@EN' + str(arpeggio[1]) + ' = { ' + arpeggio[0] + ' }\n'
+    def getTimbreMacro(self, macros):
+        return f"@@{macros.getNumberFor('timbres', self.timbre)}"
 
-        # render vibratos
-        for vibrato in Util.sortDictionary(Instrument.vibratos):
-            macros += '@MP' + str(vibrato[1]) + ' = { ' + vibrato[0] + ' }\n'
+    def getVibratoMacro(self, macros):
+        return f"MP{macros.getNumberFor('vibratos', self.vibrato)}"
 
-        # render N106
-        for macro in Util.sortDictionary(Instrument.N106):
-            waveform = Instrument.validateN106(macro[0])
-            macros += '@N' + str(macro[1]) + ' = { ' + Instrument.getN106Buffer(waveform) + ', ' + waveform + ' }\n'
+    def getN106Macro(self, macros):
+        return f"@@{macros.getNumberFor('N106', self.waveform)}"
 
-        # render FDS
-        for macro in Util.sortDictionary(Instrument.FDS):
-            macros += '@FM' + str(macro[1]) + ' = { ' + Instrument.validateFds(macro[0]) + ' }\n'
-
-        return macros
+    def getFDSMacro(self, macros):
+        return f"@@{macros.getNumberFor('FDS', self.waveform)}"
 
     @staticmethod
     def validateN106(macro):
@@ -325,6 +246,41 @@ class Instrument(object):
 
         return macro
 
+    @staticmethod
+    def compressMacro(macro, holds_last_value=True):
+        """returns a macro that plays the same with fewer values
+
+        a loop that repeats itself is cut down to one repeat and the loop point
+        moves back over values before it that the loop would play anyway.
+        without a loop the driver stays on the last value so a run at the end
+        can be a single value.  pitch and arpeggio macros add their values up
+        so only a run of 0 can go for them (holds_last_value=False).
+        """
+        values = macro.split()
+        if '|' in values:
+            loop = values.index('|')
+            before = values[:loop]
+            body = values[loop + 1:]
+            if not len(body) or '|' in body:
+                return macro
+
+            # shortest part of the loop that repeats to make the whole loop
+            for length in range(1, len(body) + 1):
+                if len(body) % length == 0 and body[:length] * (len(body) // length) == body:
+                    body = body[:length]
+                    break
+
+            # one value always stays in front of the loop
+            while len(before) > 1 and before[-1] == body[-1]:
+                body = [before.pop()] + body[:-1]
+
+            return ' '.join(before + ['|'] + body)
+
+        while len(values) > 1 and values[-1] == values[-2] and (holds_last_value or values[-1] == '0'):
+            values.pop()
+
+        return ' '.join(values)
+
     @staticmethod
     def maxBufferFromSampleLength(sample_length):
         map = {
@@ -340,34 +296,11 @@ class Instrument(object):
 
         return map[sample_length]
 
-    @staticmethod
-    def getBufferForWaveform(waveform):
-        return Instrument.N106_buffers[waveform]
-
-    @staticmethod
-    def getN106Buffer(waveform):
-        waveform = waveform.strip()
-        bits = waveform.split(' ')
-
-        max_allowed_buffer = Instrument.maxBufferFromSampleLength(len(bits))
-        buffer = Instrument.getBufferForWaveform(waveform)
-
-        if buffer is None:
-            return '00'
-
-        if buffer > max_allowed_buffer:
-            raise Exception('buffer value cannot be greater than: ' + str(max_allowed_buffer) + ' for ' + str(len(bits)) + ' samples')
-
-        if buffer < 10:
-            buffer = '0' + str(buffer)
-
-        return str(buffer)
-
     def start(self, whistle):
         start = ''
         if hasattr(self, 'timbre'):
             last_timbre = whistle.getDataForVoice(whistle.current_voices[0], 'timbre')
-            new_timbre = self.getTimbreMacro()
+            new_timbre = self.getTimbreMacro(whistle.macros)
 
             if new_timbre != last_timbre:
                 whistle.setDataForVoices(whistle.current_voices, 'timbre', new_timbre)
@@ -375,7 +308,7 @@ class Instrument(object):
 
         if hasattr(self, 'volume'):
             last_volume = whistle.getDataForVoice(whistle.current_voices[0], 'volume')
-            new_volume = self.getVolumeMacro()
+            new_volume = self.getVolumeMacro(whistle.macros)
 
             if new_volume != last_volume:
                 whistle.setDataForVoices(whistle.current_voices, 'volume', new_volume)
@@ -383,7 +316,7 @@ class Instrument(object):
 
         if hasattr(self, 'pitch'):
             last_pitch = whistle.getDataForVoice(whistle.current_voices[0], 'pitch')
-            new_pitch = self.getPitchMacro()
+            new_pitch = self.getPitchMacro(whistle.macros)
 
             if new_pitch != last_pitch:
                 whistle.setDataForVoices(whistle.current_voices, 'pitch', new_pitch)
@@ -391,7 +324,7 @@ class Instrument(object):
 
         if hasattr(self, 'arpeggio'):
             last_arpeggio = whistle.getDataForVoice(whistle.current_voices[0], 'arpeggio')
-            new_arpeggio = self.getArpeggioMacro()
+            new_arpeggio = self.getArpeggioMacro(whistle.macros)
 
             if new_arpeggio != last_arpeggio:
                 whistle.setDataForVoices(whistle.current_voices, 'arpeggio', new_arpeggio)
@@ -399,7 +332,7 @@ class Instrument(object):
 
         if hasattr(self, 'vibrato'):
             last_vibrato = whistle.getDataForVoice(whistle.current_voices[0], 'vibrato')
-            new_vibrato = self.getVibratoMacro()
+            new_vibrato = self.getVibratoMacro(whistle.macros)
 
             if new_vibrato != last_vibrato:
                 whistle.setDataForVoices(whistle.current_voices, 'vibrato', new_vibrato)
@@ -415,7 +348,7 @@ class Instrument(object):
 
         if hasattr(self, 'waveform') and self.getChip() == 'N106':
             last_n106 = whistle.getDataForVoice(whistle.current_voices[0], 'timbre')
-            new_n106 = self.getN106Macro()
+            new_n106 = self.getN106Macro(whistle.macros)
 
             if new_n106 != last_n106:
                 whistle.setDataForVoices(whistle.current_voices, 'timbre', new_n106)
@@ -423,7 +356,7 @@ class Instrument(object):
 
         if hasattr(self, 'waveform') and self.getChip() == 'FDS':
             last_fds = whistle.getDataForVoice(whistle.current_voices[0], 'timbre')
-            new_fds = self.getFDSMacro()
+            new_fds = self.getFDSMacro(whistle.macros)
 
             if new_fds != last_fds:
                 whistle.setDataForVoices(whistle.current_voices, 'timbre', new_fds)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+
+
+class LineMap(object):
+    """keeps track of the line in the source each line of a song came from
+
+    the stages that work on the whole song (comments, imports, declarations
+    and instruments) take lines out and splice files in, so a line of the song
+    ends up somewhere else by the time it is processed.  those stages make
+    their changes through sub(), which works out the source line of every line
+    of the new song from the line its first character came from.  lines that
+    come from an import are on the line of the @import.
+    """
+
+    def __init__(self, content):
+        # source line (starting at 1) for each line of the song
+        self.lines = array.array('q', range(1, content.count('\n') + 2))
+
+    def getSourceLine(self, line):
+        """returns the source line for a line of the song (starting at 0)"""
+        if line < 0 or line >= len(self.lines):
+            return None
+
+        return self.lines[line]
+
+    def sub(self, pattern, callback, content):
+        """pattern.sub(callback, content) that updates the lines to match what it returns"""
+        bits = []
+        lines = array.array('q')
+
+        # source line of the line being put together, None until something is on it
+        current = None
+
+        # line of content the position is on
+        line = 0
+        position = 0
+        for match in pattern.finditer(content):
+            start = match.start()
+            if start > position:
+                bits.append(content[position:start])
+                current, line = self.copy(content, position, start, line, current, lines)
+
+            replacement = callback(match)
+            if replacement:
+                bits.append(replacement)
+                current = self.add(replacement, self.lines[line], current, lines)
+
+            line += content.count('\n', start, match.end())
+            position = match.end()
+
+        if position < len(content):
+            bits.append(content[position:])
+            current, line = self.copy(content, position, len(content), line, current, lines)
+
+        lines.append(current if current is not None else self.lines[min(line, len(self.lines) - 1)])
+        self.lines = lines
+        return ''.join(bits)
+
+    def copy(self, content, start, end, line, current, lines):
+        """content from start to end is kept as it is"""
+        if current is None:
+            current = self.lines[line]
+
+        position = content.find('\n', start, end)
+        while position >= 0:
+            lines.append(current)
+            line += 1
+            current = self.lines[line] if position + 1 < end else None
+            position = content.find('\n', position + 1, end)
+
+        return (current, line)
+
+    def add(self, text, source, current, lines):
+        """text replaced something on the source line"""
+        if current is None:
+            current = source
+
+        position = text.find('\n')
+        while position >= 0:
+            lines.append(current)
+            current = source if position + 1 < len(text) else None
+            position = text.find('\n', position + 1)
+
+        return current
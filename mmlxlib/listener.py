@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2012 Craig Campbell
 #
@@ -13,77 +13,174 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import fnmatch
 import os
-import glob
 import time
 import sys
+from .filecache import FileCache
+from .buildqueue import BuildQueue
 
 
 class Listener(object):
 
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, file_cache=None):
         self.watching = False
         self.callback = None
         self.first_run = True
         self.file_list = {}
         self.logger = logger
 
-    def getFilesFromDir(self, path, extension=""):
-        path = path + "/*"
+        # all the songs in a directory are stat'ed and read through this
+        self.file_cache = file_cache if file_cache is not None else FileCache()
 
-        if not extension == "":
-            path = path + "." + extension.lstrip(".")
+        # look for songs in directories inside the directory as well, the
+        # output goes into the same directories inside the output directory
+        self.recursive = False
 
-        return glob.glob(path)
+        # glob patterns for songs to build (all of them if empty) and for songs
+        # and directories to leave out.  patterns with a / are matched against
+        # the path inside the directory and the rest against the name.
+        self.include = []
+        self.exclude = []
+
+        # songs waiting to be built while watching and (path, modified time)
+        # of the song being built right now
+        self.queue = BuildQueue()
+        self.building = None
 
     def onChange(self, callback):
         self.callback = callback
 
+    def matches(self, relative_path, patterns):
+        name = os.path.basename(relative_path)
+        for pattern in patterns:
+            if fnmatch.fnmatch(relative_path if '/' in pattern else name, pattern):
+                return True
+
+        return False
+
+    def getRelativePath(self, path, start):
+        return os.path.relpath(path, start).replace(os.sep, '/')
+
+    def findSongs(self, start, end, is_dir):
+        """returns a list of (song path, output path) for every song to build"""
+        if not is_dir:
+            return [] if os.path.basename(start).startswith('_') else [(start, end)]
+
+        skip_directory = None
+        if len(self.exclude):
+            skip_directory = lambda path: self.matches(self.getRelativePath(path, start), self.exclude)
+
+        songs = []
+        for file in self.file_cache.scan(start, "mmlx", self.recursive, skip_directory):
+            relative_path = self.getRelativePath(file, start)
+
+            # files starting with _ are only there to be imported
+            if os.path.basename(file).startswith('_'):
+                continue
+
+            if len(self.include) and not self.matches(relative_path, self.include):
+                continue
+
+            if self.matches(relative_path, self.exclude):
+                continue
+
+            songs.append((file, os.path.join(end, os.path.splitext(relative_path)[0].replace('/', os.sep) + '.mml')))
+
+        return songs
+
+    def findChanges(self, start, end, is_dir):
+        """returns the arguments for the callback for every song that is new or changed since the last pass"""
+        changes = []
+        for song in self.findSongs(start, end, is_dir):
+            file = song[0]
+            last_changed = self.file_cache.getModifiedTime(file)
+
+            if not file in self.file_list:
+                self.file_list[file] = last_changed
+                changes.append((file, song[1]))
+                continue
+
+            if last_changed != self.file_list[file]:
+                self.logger.log(self.logger.color("detected change to: ", self.logger.GRAY) + self.logger.color(file, self.logger.UNDERLINE))
+                self.file_list[file] = last_changed
+                changes.append((file, song[1], True))
+
+        return changes
+
+    def isStale(self):
+        """returns True if the song being built has been saved again since the build started"""
+        if self.building is None:
+            return False
+
+        try:
+            return os.stat(self.building[0]).st_mtime != self.building[1]
+        except OSError:
+            return True
+
+    def processQueue(self, start, end, is_dir):
+        """builds changed songs one at a time, looking for changes again after each one
+
+        a song that is saved again while it is being built is stopped and goes
+        back into the queue."""
+        while True:
+            self.file_cache.startBuild()
+            try:
+                for change in self.findChanges(start, end, is_dir):
+                    self.queue.add(change[0], self.file_list[change[0]], change)
+
+                if not len(self.queue):
+                    return
+
+                change = self.queue.pop()
+                self.building = (change[0], self.file_list[change[0]])
+                try:
+                    self.callback(*change)
+                except Exception:
+                    if not self.isStale():
+                        raise
+
+                    self.logger.log(self.logger.color('changed while building, starting over: ', self.logger.GRAY) + self.logger.color(change[0], self.logger.UNDERLINE))
+                finally:
+                    self.building = None
+            finally:
+                self.file_cache.finishBuild()
+
     def process(self, start, end, is_dir=None):
         try:
             if is_dir is None:
                 is_dir = os.path.isdir(start)
 
-            if is_dir:
-                files = self.getFilesFromDir(start, "mmlx")
-                output_file = None
+            if self.watching:
+                self.processQueue(start, end, is_dir)
             else:
-                files = [start]
-                output_file = end
-
-            initial_output_file = output_file
-
-            for file in files:
-                output_file = initial_output_file
+                # every file is only stat'ed once for each pass
+                self.file_cache.startBuild()
 
-                filename = os.path.basename(file)
-                if filename.startswith('_'):
-                    continue
+                # everything that changed anywhere in the tree is built in one go
+                for change in self.findChanges(start, end, is_dir):
+                    self.callback(*change)
 
-                last_changed = os.stat(file).st_mtime
-                output_file = output_file if output_file is not None else os.path.join(end, filename.replace(".mmlx", ".mml"))
-
-                if not file in self.file_list:
-                    self.file_list[file] = last_changed
-                    self.callback(file, output_file)
-                    continue
-
-                if last_changed != self.file_list[file]:
-                    self.logger.log(self.logger.color("detected change to: ", self.logger.GRAY) + self.logger.color(file, self.logger.UNDERLINE))
-                    self.file_list[file] = last_changed
-                    self.callback(file, output_file, True)
+                self.file_cache.finishBuild()
 
             if self.first_run:
                 self.logger.log('')
                 self.first_run = False
 
         except Exception:
-            self.logger.log(self.logger.color('Sorry, an error occured:\n', self.logger.RED))
+            self.file_cache.finishBuild()
+
             import traceback
             lines = traceback.format_exc().splitlines()
-            self.logger.log(self.logger.color(lines.pop(), self.logger.RED) + '\n')
-            self.logger.log('\n'.join(lines))
-            self.logger.log('')
+            error = lines.pop()
+
+            # one message so it stays in one piece with json logging
+            self.logger.log('\n'.join([
+                self.logger.color('Sorry, an error occured:\n', self.logger.RED),
+                self.logger.color(error, self.logger.RED) + '\n',
+                '\n'.join(lines),
+                ''
+            ]), level=self.logger.ERROR)
 
             # continue watching
             if self.watching:
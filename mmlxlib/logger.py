@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2012 Craig Campbell
 #
@@ -13,6 +13,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import sys
+import time
 
 
 class Logger(object):
@@ -27,34 +29,163 @@ class Logger(object):
     UNDERLINE = 'underline'
     ITALIC = 'italic'
 
+    COLORS = {
+        'italic': '\033[3m',
+        'underline': '\033[4m',
+        'light_blue': '\033[96m',
+        'pink': '\033[95m',
+        'blue': '\033[94m',
+        'yellow': '\033[93m',
+        'green': '\033[92m',
+        'red': '\033[91m',
+        'gray': '\033[90m',
+        'white': '\033[0m'
+    }
+
+    BOLD = '\033[1m'
+    END = '\033[0m'
+
+    # levels, messages below the level of the logger are dropped before they are formatted
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+
+    LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+
+    # output formats
+    TEXT = 'text'
+    JSON = 'json'
+
+    FORMATS = [TEXT, JSON]
+
     def __init__(self, options):
         self.verbose = options["verbose"]
 
+        self.level = Logger.DEBUG if self.verbose else Logger.INFO
+        if options.get('quiet'):
+            self.level = Logger.WARNING
+
+        if options.get('log_level'):
+            self.level = Logger.LEVELS[options['log_level']]
+
+        # json writes one object per line with the time, level and message (and no colors)
+        self.format = options.get('log_format') or Logger.TEXT
+
+        self.stream = sys.stdout
+
+        # lines waiting for the writer thread when it is running
+        self.queue = None
+        self.writer = None
+
     def color(self, message, color, bold=False):
-        colors = {
-            'italic': '\033[3m',
-            'underline': '\033[4m',
-            'light_blue': '\033[96m',
-            'pink': '\033[95m',
-            'blue': '\033[94m',
-            'yellow': '\033[93m',
-            'green': '\033[92m',
-            'red': '\033[91m',
-            'gray': '\033[90m',
-            'white': '\033[0m'
-        }
-
-        end = '\033[0m'
-
-        if not color in colors:
+        if self.format != Logger.TEXT or not color in Logger.COLORS:
             return message
 
-        bold_start = '\033[1m' if bold else ''
+        if bold:
+            return Logger.COLORS[color] + Logger.BOLD + message + Logger.END
+
+        return Logger.COLORS[color] + message + Logger.END
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def log(self, message, verbose_only=False, level=INFO):
+        """logs a message, verbose_only messages are logged at the debug level"""
+        if verbose_only:
+            level = Logger.DEBUG
+
+        if level < self.level:
+            return
+
+        self.emit(level, message)
+
+    def logFormatted(self, level, message, args):
+        if level < self.level:
+            return
+
+        self.emit(level, message % args if len(args) else message)
+
+    def debug(self, message, *args):
+        """logs message % args in verbose mode, nothing is formatted otherwise"""
+        self.logFormatted(Logger.DEBUG, message, args)
+
+    def info(self, message, *args):
+        self.logFormatted(Logger.INFO, message, args)
 
-        return colors[color] + bold_start + message + end
+    def warning(self, message, *args):
+        self.logFormatted(Logger.WARNING, message, args)
 
-    def log(self, message, verbose_only=False):
-        if verbose_only and not self.verbose:
+    def error(self, message, *args):
+        self.logFormatted(Logger.ERROR, message, args)
+
+    def getLevelName(self, level):
+        for name in Logger.LEVELS:
+            if Logger.LEVELS[name] == level:
+                return name
+
+        return str(level)
+
+    def emit(self, level, message):
+        if self.format == Logger.JSON:
+            import json
+            message = json.dumps({'time': round(time.time(), 3), 'level': self.getLevelName(level), 'message': message}, sort_keys=True)
+
+        if self.queue is not None:
+            self.queue.put(message)
+            return
+
+        self.write(message)
+
+    def write(self, line):
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def startWriter(self):
+        """writes lines from a separate thread so jobs running at the same time
+        never wait on the terminal and never write over each other"""
+        if self.writer is not None:
+            return
+
+        import threading
+        from queue import Queue
+
+        self.queue = Queue()
+        self.writer = threading.Thread(target=self.runWriter, args=(self.queue,))
+        self.writer.daemon = True
+        self.writer.start()
+
+    def runWriter(self, queue):
+        while True:
+            line = queue.get()
+            if line is None:
+                break
+
+            self.write(line)
+
+    def stopWriter(self):
+        """waits for every queued line to be written"""
+        if self.writer is None:
             return
 
-        print message
+        queue = self.queue
+        self.queue = None
+        queue.put(None)
+        self.writer.join()
+        self.writer = None
+
+
+class BufferedLogger(Logger):
+    """a logger that keeps messages instead of printing them
+
+    used when mmlx is called as a library so nothing ends up on stdout"""
+
+    def __init__(self, options):
+        Logger.__init__(self, options)
+        self.messages = []
+
+    def color(self, message, color, bold=False):
+        return message
+
+    def emit(self, level, message):
+        self.messages.append(message)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from .util import Util
+from .instrument import Instrument
+
+
+class Macros(object):
+    """keeps track of the macros used by instruments in a song and the number each one gets
+
+    every song being processed has its own so nothing is shared between compiles"""
+
+    # registry name => counter name
+    REGISTRIES = {
+        'timbres': 'timbre',
+        'volumes': 'volume',
+        'pitches': 'pitch',
+        'arpeggios': 'arpeggio',
+        'vibratos': 'vibrato',
+        'N106': 'N106',
+        'FDS': 'FDS'
+    }
+
+    # registries compressMacro can shorten => whether the driver holds their last value
+    COMPRESSIBLE = {
+        'timbres': True,
+        'volumes': True,
+        'pitches': False,
+        'arpeggios': False
+    }
+
+    # what getNumberFor hands out in place of a new number while a VoicePool
+    # worker processes lines, the pool swaps in the real numbers afterwards
+    PLACEHOLDER = '\x01%s:%d\x01'
+
+    # one dictionary of value => number for each registry
+    __slots__ = ('compress', 'counters', 'N106_buffers', 'deduplicated', 'compressed', 'placeholders') + tuple(REGISTRIES)
+
+    def __init__(self, counter=0, compress=False):
+        self.compress = compress
+        self.reset(counter)
+
+    def reset(self, counter=0):
+        counter = int(counter)
+
+        self.counters = {}
+        for registry in Macros.REGISTRIES:
+            self.counters[Macros.REGISTRIES[registry]] = counter
+            setattr(self, registry, {})
+
+        self.N106_buffers = {}
+
+        # how many times an instrument asked for a macro that already existed
+        self.deduplicated = 0
+
+        # (macro name, bytes before, bytes after) for every macro compressed
+        self.compressed = []
+
+        # counter name => first number that is a placeholder, see usePlaceholders
+        self.placeholders = None
+
+    def getCountFor(self, macro):
+        i = self.counters[macro]
+        self.counters[macro] += 1
+        return i
+
+    def getNumberFor(self, registry, value):
+        """returns the number for a macro value, the first time a value is seen it gets the next number"""
+        macros = getattr(self, registry)
+        if value in macros:
+            self.deduplicated += 1
+            return self.getReference(registry, macros[value])
+
+        macros[value] = self.getCountFor(Macros.REGISTRIES[registry])
+        return self.getReference(registry, macros[value])
+
+    def usePlaceholders(self):
+        """macros created from now on get placeholders instead of numbers
+
+        macros that already have a number keep it"""
+        self.placeholders = dict(self.counters)
+
+    def getReference(self, registry, number):
+        if self.placeholders is None or number < self.placeholders[Macros.REGISTRIES[registry]]:
+            return number
+
+        return Macros.PLACEHOLDER % (registry, number)
+
+    def getPlaceheld(self):
+        """returns registry => {placeholder number: value} for the macros created since usePlaceholders"""
+        placeheld = {}
+        for registry in Macros.REGISTRIES:
+            first = self.placeholders[Macros.REGISTRIES[registry]]
+            macros = getattr(self, registry)
+            placeheld[registry] = dict([(macros[value], value) for value in macros if macros[value] >= first])
+
+        return placeheld
+
+    def getCount(self):
+        count = 0
+        for registry in Macros.REGISTRIES:
+            count += len(getattr(self, registry))
+
+        return count
+
+    def hasBeenUsed(self):
+        for registry in Macros.REGISTRIES:
+            if len(getattr(self, registry)) > 0:
+                return True
+
+        return False
+
+    def getValue(self, registry, name, value):
+        """returns the value to render for a macro, compressed if compression is on"""
+        if not self.compress or not registry in Macros.COMPRESSIBLE:
+            return value
+
+        compressed = Instrument.compressMacro(value, Macros.COMPRESSIBLE[registry])
+
+        # every value is a byte in the nsf
+        before = len([bit for bit in value.split() if bit != '|'])
+        after = len([bit for bit in compressed.split() if bit != '|'])
+        if after < before:
+            self.compressed.append((name, before, after))
+
+        return compressed
+
+    def getBytesSaved(self):
+        return sum([macro[1] - macro[2] for macro in self.compressed])
+
+    def renderLines(self):
+        macros = []
+        self.compressed = []
+
+        # render timbres
+        for timbre in Util.sortDictionary(self.timbres):
+            name = '@' + str(timbre[1])
+            macros.append(name + ' = { ' + self.getValue('timbres', name, timbre[0]) + ' }')
+
+        # render volumes
+        for volume in Util.sortDictionary(self.volumes):
+            name = '@v' + str(volume[1])
+            macros.append(name + ' = { ' + self.getValue('volumes', name, volume[0]) + ' }')
+
+        # render pitches
+        for pitch in Util.sortDictionary(self.pitches):
+            name = '@EP' + str(pitch[1])
+            macros.append(name + ' = { ' + self.getValue('pitches', name, pitch[0]) + ' }')
+
+        # render arpeggios
+        for arpeggio in Util.sortDictionary(self.arpeggios):
+            name = '@EN' + str(arpeggio[1])
+            macros.append(name + ' = { ' + self.getValue('arpeggios', name, arpeggio[0]) + ' }')
+
+        # render vibratos
+        for vibrato in Util.sortDictionary(self.vibratos):
+            macros.append('@MP' + str(vibrato[1]) + ' = { ' + vibrato[0] + ' }')
+
+        # render N106
+        for macro in Util.sortDictionary(self.N106):
+            waveform = Instrument.validateN106(macro[0])
+            macros.append('@N' + str(macro[1]) + ' = { ' + self.getN106Buffer(waveform) + ', ' + waveform + ' }')
+
+        # render FDS
+        for macro in Util.sortDictionary(self.FDS):
+            macros.append('@FM' + str(macro[1]) + ' = { ' + Instrument.validateFds(macro[0]) + ' }')
+
+        return macros
+
+    def render(self):
+        return ''.join([line + '\n' for line in self.renderLines()])
+
+    def setBufferForWaveform(self, waveform, buffer):
+        self.N106_buffers[waveform] = buffer
+
+    def getBufferForWaveform(self, waveform):
+        return self.N106_buffers[waveform]
+
+    def getN106Buffer(self, waveform):
+        waveform = waveform.strip()
+        bits = waveform.split(' ')
+
+        max_allowed_buffer = Instrument.maxBufferFromSampleLength(len(bits))
+        buffer = self.getBufferForWaveform(waveform)
+
+        if buffer is None:
+            return '00'
+
+        if buffer > max_allowed_buffer:
+            raise Exception('buffer value cannot be greater than: ' + str(max_allowed_buffer) + ' for ' + str(len(bits)) + ' samples')
+
+        if buffer < 10:
+            buffer = '0' + str(buffer)
+
+        return str(buffer)
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2012 Craig Campbell
 #
@@ -15,10 +15,15 @@
 # limitations under the License.
 import re
 import math
-from curve import Curve
+from .curve import Curve
 
 
 class MagicMacro(object):
+    __slots__ = ('macro', 'step_size', 'repeat_count', 'curve_type')
+
+    # 15..0 or 0(.5)..15
+    MAGIC_STEPS = re.compile(r'(\d+)(\((\+|\-)?(\.?\d+(\.\d+)?)\))?..(\d+)')
+
     def __init__(self, macro):
         # print "creating object with macro", macro
         self.macro = macro
@@ -94,7 +99,7 @@ class MagicMacro(object):
                 values.append(group)
                 continue
 
-            match = re.match(r'(\d+)(\((\+|\-)?(\.?\d+(\.\d+)?)\))?..(\d+)', group)
+            match = MagicMacro.MAGIC_STEPS.match(group)
             if not match:
                 values.append(group)
                 continue
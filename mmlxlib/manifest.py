@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""a list of songs to build with their own options
+
+    {
+        "options": {"create_nsf": true},
+        "jobs": [
+            {"input": "songs/title.mmlx", "output": "build/title.nsf"},
+            {"input": "songs/boss.mmlx", "options": {"separate_voices": true}},
+            {"input": "songs/credits.mmlx", "output": "build/mml/", "options": {"create_mml": true, "create_nsf": false}}
+        ]
+    }
+
+paths are relative to the manifest.  the output defaults to the input with an
+.mml extension and can be a directory (ending in /).  options for every job go
+in the top level options and can be overridden for each job.  a manifest can
+also be just the list of jobs.
+"""
+import json
+import os
+from .util import Util
+
+
+class Manifest(object):
+
+    # options that can be set in a manifest
+    OPTIONS = ['separate_voices', 'create_mml', 'create_nsf', 'import_path', 'open_nsf', 'compress_macros', 'size_report', 'size_budget', 'parallel_voices', 'dpcm_cache']
+
+    # options that are true or false
+    FLAGS = ['separate_voices', 'create_mml', 'create_nsf', 'open_nsf', 'compress_macros', 'size_report']
+
+    # options that are a number above 0 (or null to leave them off)
+    NUMBERS = ['size_budget', 'parallel_voices']
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+
+        try:
+            data = json.loads(Util.openFile(path))
+        except ValueError as e:
+            raise Exception('manifest ' + path + ' is not valid json: ' + str(e))
+
+        if isinstance(data, list):
+            data = {'jobs': data}
+
+        if not isinstance(data, dict) or not isinstance(data.get('jobs'), list):
+            raise Exception('manifest ' + path + ' needs a list of jobs')
+
+        self.options = self.checkOptions(data.get('options') or {}, 'manifest options')
+        self.jobs = [self.checkJob(job, key + 1) for key, job in enumerate(data['jobs'])]
+
+    def checkOptions(self, options, name):
+        for key in options:
+            if not key in Manifest.OPTIONS:
+                raise Exception('unknown option "' + key + '" in ' + name + ', use one of ' + ', '.join(Manifest.OPTIONS))
+
+            self.checkType(key, options[key], name)
+
+        # library directories are relative to the manifest too
+        if 'import_path' in options:
+            options['import_path'] = [self.getPath(path) for path in options['import_path']]
+
+        if options.get('dpcm_cache'):
+            options['dpcm_cache'] = self.getPath(options['dpcm_cache'])
+
+        return options
+
+    def checkType(self, key, value, name):
+        if key in Manifest.FLAGS and not isinstance(value, bool):
+            raise Exception('option "' + key + '" in ' + name + ' has to be true or false')
+
+        # true and false are numbers as far as python is concerned
+        if key in Manifest.NUMBERS and value is not None and (isinstance(value, bool) or not isinstance(value, int) or value <= 0):
+            raise Exception('option "' + key + '" in ' + name + ' has to be a number above 0')
+
+        if key == 'import_path' and (not isinstance(value, list) or [path for path in value if not isinstance(path, str)]):
+            raise Exception('option "import_path" in ' + name + ' has to be a list of directories')
+
+        if key == 'dpcm_cache' and value is not None and not isinstance(value, str):
+            raise Exception('option "dpcm_cache" in ' + name + ' has to be a directory')
+
+    def checkJob(self, job, number):
+        name = 'manifest job ' + str(number)
+        # a job can be just the input
+        if hasattr(job, 'encode'):
+            job = {'input': job}
+
+        if not isinstance(job, dict) or not job.get('input'):
+            raise Exception(name + ' needs an input')
+
+        return {
+            'input': self.getPath(job['input']),
+            'output': self.getPath(job['output']) if job.get('output') else None,
+            'output_directory': (job.get('output') or '').endswith('/'),
+            'options': self.checkOptions(job.get('options') or {}, name)
+        }
+
+    def getPath(self, path):
+        return os.path.normpath(os.path.join(self.directory, path))
+
+    def getOutput(self, job):
+        """path of the mml for a job (the nsf goes next to it)"""
+        input = job['input']
+        output = job['output']
+
+        if output is None:
+            output = os.path.splitext(input)[0] + '.mml'
+        elif job['output_directory'] or os.path.isdir(output):
+            output = os.path.join(output, os.path.splitext(os.path.basename(input))[0] + '.mml')
+
+        return output.replace('.nsf', '.mml')
+
+    def getJobs(self, options):
+        """returns (input, output, options) for every job with options on top of the ones given"""
+        jobs = []
+        for job in self.jobs:
+            job_options = options.copy()
+            job_options.update(self.options)
+            job_options.update(job['options'])
+
+            output = self.getOutput(job)
+            job_options['start'] = job['input']
+            job_options['end'] = output
+
+            jobs.append((job['input'], output, job_options))
+
+        return jobs
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2012 Craig Campbell
 #
@@ -14,14 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
-import subprocess
 import sys
-import shutil
-from warpwhistle import WarpWhistle
-from util import Util
-from instrument import Instrument
-from listener import Listener
-from logger import Logger
+from .logger import Logger
+
+# everything else is imported when it is needed so that --help, argument
+# errors and editors starting mmlx for every save don't wait for it
 
 
 class MusicBox(object):
@@ -36,8 +33,29 @@ class MusicBox(object):
             'create_nsf': True,
             'create_mml': False,
             'separate_voices': False,
+            'compress_macros': False,
+            'parallel_voices': None,
+            'dpcm_cache': None,
             'start': None,
-            'end': None
+            'end': None,
+            'quiet': False,
+            'log_level': None,
+            'log_format': None,
+            'manifest': None,
+            'check': False,
+            'size_report': False,
+            'size_budget': None,
+            'serve': False,
+            'socket': None,
+            'profile': False,
+            'profile_memory': False,
+            'profile_json': None,
+            'profile_out': None,
+            'profile_format': None,
+            'import_path': [],
+            'recursive': False,
+            'include': [],
+            'exclude': []
         }
 
         if '--help' in args:
@@ -47,10 +65,26 @@ class MusicBox(object):
             for key, arg in enumerate(args):
                 if arg == '--verbose':
                     options['verbose'] = True
+                elif arg == '--quiet':
+                    options['quiet'] = True
+                elif arg == '--log-level':
+                    options['log_level'] = args[key + 1]
+                    del(args[key + 1])
+                elif arg == '--log-format':
+                    options['log_format'] = args[key + 1]
+                    del(args[key + 1])
                 elif arg == '--open-nsf':
                     options['open_nsf'] = True
                 elif arg == '--bob-omb':
                     options['separate_voices'] = True
+                elif arg == '--compress-macros':
+                    options['compress_macros'] = True
+                elif arg == '--parallel-voices':
+                    options['parallel_voices'] = int(args[key + 1])
+                    del(args[key + 1])
+                elif arg == '--dpcm-cache':
+                    options['dpcm_cache'] = args[key + 1]
+                    del(args[key + 1])
                 elif arg == '--create-nsf':
                     value = args[key + 1]
                     del(args[key + 1])
@@ -59,6 +93,48 @@ class MusicBox(object):
                     value = args[key + 1]
                     del(args[key + 1])
                     options['create_mml'] = True if value == '1' else False
+                elif arg == '--profile':
+                    options['profile'] = True
+                elif arg == '--profile-memory':
+                    options['profile'] = True
+                    options['profile_memory'] = True
+                elif arg == '--profile-json':
+                    options['profile'] = True
+                    options['profile_json'] = args[key + 1]
+                    del(args[key + 1])
+                elif arg == '--profile-out':
+                    options['profile_out'] = args[key + 1]
+                    del(args[key + 1])
+                elif arg == '--profile-format':
+                    options['profile_format'] = args[key + 1]
+                    del(args[key + 1])
+                elif arg == '--recursive':
+                    options['recursive'] = True
+                elif arg == '--include':
+                    options['include'].append(args[key + 1])
+                    del(args[key + 1])
+                elif arg == '--exclude':
+                    options['exclude'].append(args[key + 1])
+                    del(args[key + 1])
+                elif arg == '--import-path':
+                    options['import_path'] += [path for path in args[key + 1].split(os.pathsep) if path]
+                    del(args[key + 1])
+                elif arg == '--check':
+                    options['check'] = True
+                elif arg == '--size-report':
+                    options['size_report'] = True
+                elif arg == '--size-budget':
+                    options['size_report'] = True
+                    options['size_budget'] = int(args[key + 1])
+                    del(args[key + 1])
+                elif arg == '--manifest':
+                    options['manifest'] = args[key + 1]
+                    del(args[key + 1])
+                elif arg == '--serve':
+                    options['serve'] = True
+                    if len(args) > key + 1 and not args[key + 1].startswith('--'):
+                        options['socket'] = args[key + 1]
+                        del(args[key + 1])
                 elif arg == '--watch':
                     options['listen'] = True
                     value = args[key + 1]
@@ -77,10 +153,37 @@ class MusicBox(object):
         if not options['create_nsf'] and not options['create_mml']:
             self.showUsage('You need to create an MML file or an NSF file')
 
+        if options['log_level'] is not None and not options['log_level'] in Logger.LEVELS:
+            self.showUsage('The log level has to be one of: ' + ', '.join(sorted(Logger.LEVELS, key=Logger.LEVELS.get)))
+
+        if options['log_format'] is not None and not options['log_format'] in Logger.FORMATS:
+            self.showUsage('The log format has to be one of: ' + ', '.join(Logger.FORMATS))
+
+        if options['size_budget'] is not None and options['size_budget'] <= 0:
+            self.showUsage('The size budget has to be a number of bytes')
+
+        if options['parallel_voices'] is not None and options['parallel_voices'] <= 0:
+            self.showUsage('The number of processes for voices has to be at least 1')
+
+        if options['profile_format'] is not None:
+            from .capture import Capture
+            if not options['profile_format'] in Capture.FORMATS:
+                self.showUsage('The profile format has to be one of: ' + ', '.join(Capture.FORMATS))
+
+        # songs are sent to the server or listed in the manifest so there is nothing else to check
+        if options['serve']:
+            return options
+
+        if options['manifest'] is not None:
+            if not os.path.isfile(options['manifest']):
+                self.showUsage(self.logger.color(options['manifest'], self.logger.YELLOW) + " is not a file")
+
+            return options
+
         if options['start'] is None:
             self.showUsage('You haven\'t specified a file or directory to convert')
 
-        if not Util.isFileOrDirectory(options['start']):
+        if not os.path.isfile(options['start']) and not os.path.isdir(options['start']):
             self.showUsage(self.logger.color(options['start'], self.logger.YELLOW) + " is not a file or directory")
 
         if options['end'] is None:
@@ -93,27 +196,182 @@ class MusicBox(object):
     def play(self, args, local):
         # create an intial logger so we can log before args are processed
         self.logger = Logger({"verbose": False})
-        self.drawLogo()
+
+        if self.shouldDrawLogo(args):
+            self.drawLogo()
 
         options = self.processArgs(args, local)
         self.options = options
 
-        # set up the logger with the correct options
-        self.logger = Logger(self.options)
+        if options['serve']:
+            return self.serve()
 
-        listener = Listener(self.logger)
-        listener.onChange(self.processFile)
+        self.setUp()
 
-        if os.path.isdir(options['start']) and not os.path.isdir(options['end']):
+        # everything is written from one thread so messages from different
+        # songs and voices never end up in the middle of each other
+        self.logger.startWriter()
+        try:
+            self.run()
+        finally:
+            self.logger.stopWriter()
+
+    def run(self):
+        from .listener import Listener
+
+        options = self.options
+        if options['manifest'] is not None:
+            return self.build(options['manifest'])
+
+        listener = Listener(self.logger, self.file_cache)
+        listener.recursive = options['recursive']
+        listener.include = options['include']
+        listener.exclude = options['exclude']
+        listener.onChange(self.processFile if options['profile_out'] is None else self.captureFile)
+
+        if options['check']:
+            listener.onChange(self.checkFile)
+        elif os.path.isdir(options['start']) and not os.path.isdir(options['end']):
             os.mkdir(options['end'])
 
         if self.options['listen']:
+            # stop building a song that is saved again in the middle of the build
+            self.assembler.should_cancel = listener.isStale
             listener.watch(options['start'], options['end'])
+        elif options['check']:
+            listener.process(options['start'], options['end'])
+            sys.exit(self.showCheckResult())
         else:
             listener.process(options['start'], options['end'])
             self.logger.log(self.logger.color('Done!', self.logger.PINK))
             sys.exit(0)
 
+    def setUp(self):
+        from .assembler import Assembler
+        from .importer import Importer
+        from .filecache import FileCache
+
+        # set up the logger with the correct options
+        self.logger = Logger(self.options)
+        self.assembler = Assembler(self.logger, self.options)
+
+        # file path => profile for every file processed so far
+        self.profiles = {}
+
+        # songs and imported files are kept between compiles and read again when they change
+        self.file_cache = FileCache()
+        self.importer = Importer(self.file_cache)
+
+        # set to a dictionary to share parsed instruments between songs
+        self.instrument_cache = None
+
+        # errors, warnings, files and seconds for --check
+        self.checked = {'error': 0, 'warning': 0, 'files': 0, 'time': 0}
+
+    def build(self, path):
+        """builds every job in a manifest, one after the other, sharing caches and the ppmck workspace"""
+        import shutil
+        from timeit import default_timer
+        from .manifest import Manifest
+        from .assembler import Assembler
+
+        try:
+            jobs = Manifest(path).getJobs(self.options)
+        except Exception as e:
+            self.logger.error(self.logger.color('ERROR: ', self.logger.RED) + str(e))
+            sys.exit(1)
+
+        options = self.options
+        workspace = self.assembler.createWorkspace()
+        self.instrument_cache = {}
+
+        # (input, seconds, error or None, seconds for each command) for every job
+        results = []
+        try:
+            for job in jobs:
+                self.options = job[2]
+                self.assembler = Assembler(self.logger, self.options, workspace)
+
+                if not self.options['create_mml'] and not self.options['create_nsf']:
+                    results.append((job[0], 0, 'needs to create an MML file or an NSF file', {}))
+                    continue
+
+                start = default_timer()
+                try:
+                    self.processFile(job[0], job[1])
+                    error = None
+                except Exception as e:
+                    error = str(e)
+                    self.logger.error(self.logger.color('failed to build ' + job[0] + ': ', self.logger.RED) + error)
+
+                results.append((job[0], default_timer() - start, error, self.assembler.durations))
+        finally:
+            self.options = options
+            shutil.rmtree(workspace, True)
+
+        failed = self.showReport(results)
+        sys.exit(1 if failed else 0)
+
+    def formatDurations(self, durations):
+        return ', '.join(['%s %.2fms' % (name, durations[name] * 1000) for name in durations])
+
+    def showReport(self, results):
+        """logs the time each job took (and how much of it was ppmckc and
+        nesasm) and returns how many failed"""
+        failed = 0
+        total = 0
+        durations = {}
+        self.logger.log('')
+        for result in results:
+            total += result[1]
+            status = self.logger.color('ok', self.logger.GREEN)
+            if result[2] is not None:
+                failed += 1
+                status = self.logger.color('FAILED: ' + result[2], self.logger.RED)
+
+            for name in result[3]:
+                durations[name] = durations.get(name, 0.0) + result[3][name]
+
+            if len(result[3]):
+                status += self.logger.color('  (' + self.formatDurations(result[3]) + ')', self.logger.GRAY)
+
+            self.logger.log('%-50s %10.2fms  %s' % (result[0], result[1] * 1000, status))
+
+        summary = '%d built, %d failed' % (len(results) - failed, failed)
+        if len(durations):
+            summary += self.logger.color('  (' + self.formatDurations(durations) + ')', self.logger.GRAY)
+
+        self.logger.log('%-50s %10.2fms  %s' % ('total', total * 1000, summary))
+        return failed
+
+    def shouldDrawLogo(self, args):
+        # when serving over stdin/stdout anything printed would be part of a response
+        if '--serve' in args or '--quiet' in args or '--log-format' in args:
+            return False
+
+        # nobody is looking when the output goes to an editor or a file
+        return sys.stdout.isatty()
+
+    def serve(self):
+        import signal
+        from .server import Server
+
+        # make sure the socket and workspace are cleaned up when we are stopped
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        server = Server(self.options)
+        try:
+            if self.options['socket'] is not None:
+                server.serveSocket(self.options['socket'])
+            else:
+                server.serveStream(sys.stdin, sys.stdout)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+
+        sys.exit(0)
+
     def drawLogo(self):
         self.logger.log(self.logger.color('_|      _|  _|      _|  _|        _|      _|  ', self.logger.PINK))
         self.logger.log(self.logger.color('_|_|  _|_|  _|_|  _|_|  _|          _|  _|    ', self.logger.PINK))
@@ -131,11 +389,31 @@ class MusicBox(object):
         logger.log(logger.color('ARGUMENTS:', logger.WHITE, True))
         logger.log(logger.color('--help', logger.WHITE) + '                                shows help dialogue')
         logger.log(logger.color('--verbose', logger.WHITE) + '                             shows verbose output')
+        logger.log(logger.color('--quiet', logger.WHITE) + '                               only shows warnings and errors and no logo (the logo is never drawn when output is not a terminal)')
+        logger.log(logger.color('--log-level', logger.WHITE) + logger.color(' info', logger.YELLOW) + '                      shows messages at this level and up: debug, info, warning or error')
+        logger.log(logger.color('--log-format', logger.WHITE) + logger.color(' json', logger.YELLOW) + '                     writes messages as json lines with the time, level and message')
         logger.log(logger.color('--open-nsf', logger.WHITE) + '                            opens nsf file on save')
         logger.log(logger.color('--bob-omb', logger.WHITE) + '                             generates a separate NSF file for each voice')
+        logger.log(logger.color('--compress-macros', logger.WHITE) + '                     shortens volume, duty, pitch and arpeggio macros without changing how they sound')
+        logger.log(logger.color('--parallel-voices', logger.WHITE) + logger.color(' 4', logger.YELLOW) + '                   processes groups of voices in this many processes at once')
         logger.log(logger.color('--create-mml ' + logger.color('0', logger.YELLOW), logger.WHITE) + '                        creates an MML file on save (defaults to 0)')
         logger.log(logger.color('--create-nsf ' + logger.color('1', logger.YELLOW), logger.WHITE) + '                        creates an NSF file on save (defaults to 1)')
         logger.log(logger.color('--watch', logger.WHITE) + logger.color(' path/to/mmlx', logger.YELLOW) + logger.color(':', logger.GRAY) + logger.color('path/to/mml', logger.YELLOW) + '      watches for changes in first directory and compiles to second')
+        logger.log(logger.color('--recursive', logger.WHITE) + '                           also builds songs in directories inside the directory')
+        logger.log(logger.color('--include', logger.WHITE) + logger.color(' "album*/*.mmlx"', logger.YELLOW) + '             only builds songs matching the pattern (can be repeated)')
+        logger.log(logger.color('--exclude', logger.WHITE) + logger.color(' "drafts"', logger.YELLOW) + '                    leaves out songs and directories matching the pattern (can be repeated)')
+        logger.log(logger.color('--import-path', logger.WHITE) + logger.color(' path/to/lib', logger.YELLOW) + '             also looks for imports in these directories (separated by ' + os.pathsep + ')')
+        logger.log(logger.color('--dpcm-cache', logger.WHITE) + logger.color(' path/to/cache', logger.YELLOW) + '            keeps dmc samples converted from wav files here (defaults to ~/.cache/mmlx/dpcm)')
+        logger.log(logger.color('--profile', logger.WHITE) + '                             shows how long each stage takes and what was processed')
+        logger.log(logger.color('--profile-memory', logger.WHITE) + '                      also shows the memory allocated in each stage (slower)')
+        logger.log(logger.color('--profile-json', logger.WHITE) + logger.color(' path/to/json', logger.YELLOW) + '          also writes the profile as json')
+        logger.log(logger.color('--profile-out', logger.WHITE) + logger.color(' path/to/file.prof', logger.YELLOW) + '        writes a cProfile capture of each compile (one per song for a directory)')
+        logger.log(logger.color('--profile-format', logger.WHITE) + logger.color(' collapsed', logger.YELLOW) + '            writes collapsed stacks for flamegraphs instead of pstats')
+        logger.log(logger.color('--size-report', logger.WHITE) + '                         shows an estimate of how many bytes each voice and kind of macro takes up')
+        logger.log(logger.color('--size-budget', logger.WHITE) + logger.color(' 8192', logger.YELLOW) + '                    fails the build if a song would take up more bytes than this')
+        logger.log(logger.color('--check', logger.WHITE) + '                               checks songs and the mml they generate for mistakes without writing anything')
+        logger.log(logger.color('--manifest', logger.WHITE) + logger.color(' path/to/build.json', logger.YELLOW) + '         builds every song listed in a json manifest with its own options')
+        logger.log(logger.color('--serve', logger.WHITE) + logger.color(' path/to/socket', logger.YELLOW) + '                compiles json requests from a unix socket (or stdin if no socket is given)')
         logger.log(logger.color('\nEXAMPLES:', logger.WHITE, True))
 
         logger.log(logger.color('watch directory for changes in .mmlx files:', logger.GRAY))
@@ -153,87 +431,221 @@ class MusicBox(object):
 
         logger.log(logger.color('\nrun once for a directory:', logger.GRAY))
         logger.log(logger.color('mmlx path/to/mmlx path/to/nsf', logger.BLUE, True))
+
+        logger.log(logger.color('\nbuild a whole tree of albums except for drafts:', logger.GRAY))
+        logger.log(logger.color('mmlx path/to/mmlx path/to/nsf --recursive --exclude drafts', logger.BLUE, True))
+
+        logger.log(logger.color('\ncheck every song in a directory for mistakes:', logger.GRAY))
+        logger.log(logger.color('mmlx path/to/mmlx --check', logger.BLUE, True))
+
+        logger.log(logger.color('\nkeep a compile server running for an editor:', logger.GRAY))
+        logger.log(logger.color('mmlx --serve /tmp/mmlx.sock', logger.BLUE, True))
         logger.log('')
 
         sys.exit(1)
 
-    def createNSF(self, path, open_file=False):
-        self.logger.log('generating file: ' + self.logger.color(path.replace('.mml', '.nsf'), self.logger.YELLOW))
-
-        nes_include_path = os.path.join(os.path.dirname(__file__), 'nes_include')
-        bin_dir = os.path.join(nes_include_path, '../../bin')
-
-        # copy the nes include directory locally so we don't have to deal with permission problems
-        if not self.options['local']:
-            new_nes_include_path = os.path.join(os.path.dirname(path), 'nes_include')
-            shutil.copytree(nes_include_path, new_nes_include_path)
-            nes_include_path = new_nes_include_path
-
-        os.environ['NES_INCLUDE'] = nes_include_path
-        command = os.path.join(bin_dir, 'ppmckc') if self.options['local'] else 'ppmckc'
-        subprocess.Popen([command, '-m1', '-i', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-        # print output.communicate()
-        # stdout = parts[0]
-        # stderr = parts[1]
-
-        command = os.path.join(bin_dir, 'nesasm') if self.options['local'] else 'nesasm'
-        subprocess.Popen([command, '-s', '-raw', os.path.join(nes_include_path, 'ppmck.asm')], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-        # parts = output.communicate()
-        # stdout = parts[0]
-        # stderr = parts[1]
-
-        nsf_path = os.path.join(nes_include_path, 'ppmck.nes')
-        if not os.path.isfile(nsf_path):
-            os.unlink('define.inc')
-            self.logger.log('')
-            if not self.options['local']:
-                shutil.rmtree(nes_include_path)
-            raise Exception('failed to create NSF file! Your MML is probably invalid.')
-
-        os.rename(nsf_path, path.replace('.mml', '.nsf'))
-        os.unlink('define.inc')
-        os.unlink('effect.h')
-        os.unlink(path.replace('.mml', '.h'))
-        if not self.options['local']:
-            shutil.rmtree(nes_include_path)
-
-        if open_file and self.options['open_nsf']:
-            subprocess.call(['open', path.replace('.mml', '.nsf')])
+    def openNSF(self, path):
+        import subprocess
+        subprocess.call(['open', path])
+
+    def captureFile(self, input, output, open_file=False):
+        """processes a file with python's profiler running"""
+        from .capture import Capture
+
+        path = self.options['profile_out']
+        if os.path.isdir(self.options['start']):
+            path = Capture.getPathFor(path, input, self.options['start'])
+
+        Capture(path, self.options['profile_format'] or Capture.PSTATS).run(self.processFile, input, output, open_file)
+        self.logger.log('wrote profile: ' + self.logger.color(path, self.logger.YELLOW))
 
     def processFile(self, input, output, open_file=False):
-        Instrument.reset()
+        from .warpwhistle import WarpWhistle
+        from .profiler import Profiler
 
-        self.logger.log('processing file: ' + self.logger.color(input, self.logger.YELLOW), True)
-        content = Util.openFile(input)
+        self.logger.debug('processing file: %s', input)
+        content = self.file_cache.read(input)
 
         whistle = WarpWhistle(content, self.logger, self.options)
         whistle.import_directory = os.path.dirname(input)
+        whistle.importer = self.importer
+        whistle.instrument_cache = self.instrument_cache
+
+        # songs in directories inside the one being built go into the same directories in the output
+        directory = os.path.dirname(output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if self.options['profile']:
+            whistle.profiler = Profiler(self.options['profile_memory'])
+            self.assembler.profiler = whistle.profiler
 
         while whistle.isPlaying():
             open_file = open_file and whistle.first_run
 
-            song = whistle.play()
+            song = whistle.record()
 
             new_output = output
             if song[1] is not None:
                 new_output = new_output.replace('.mml', '_' + song[1] + '.mml')
 
+            if self.options['size_report']:
+                self.showSize(new_output, song[0])
+
             self.handleProcessedFile(song[0], new_output, open_file)
+            song[0].close()
 
         if self.options['separate_voices']:
             self.logger.log("")
 
-    def handleProcessedFile(self, content, output, open_file=False):
+        if whistle.profiler is not None:
+            self.showProfile(input, whistle.profiler)
+
+    def checkFile(self, input, output, open_file=False):
+        """compiles a song without writing anything and validates the mml it generates"""
+        from timeit import default_timer
+        from .warpwhistle import WarpWhistle
+        from .validator import Validator
+
+        start = default_timer()
+        diagnostics = []
+        try:
+            whistle = WarpWhistle(self.file_cache.read(input), self.logger, self.options)
+            whistle.import_directory = os.path.dirname(input)
+            whistle.importer = self.importer
+            whistle.instrument_cache = self.instrument_cache
+
+            while whistle.isPlaying():
+                song = whistle.record()
+                try:
+                    mml = song[0].getvalue()
+                finally:
+                    song[0].close()
+
+                lines = mml.splitlines()
+                for diagnostic in Validator().validate(mml):
+                    if diagnostic['line'] is not None:
+                        diagnostic['source_line'] = song[0].getSourceLine(diagnostic['line'])
+
+                    if song[1] is not None:
+                        diagnostic['message'] = 'voice ' + song[1] + ': ' + diagnostic['message']
+
+                    diagnostics.append((input, diagnostic, lines))
+        except Exception as e:
+            diagnostics.append((input, {'line': None, 'level': Validator.ERROR, 'message': str(e)}, None))
+
+        self.checked['time'] += default_timer() - start
+        self.checked['files'] += 1
+
+        for diagnostic in diagnostics:
+            self.logDiagnostic(diagnostic[0], diagnostic[1], diagnostic[2])
+
+    def logDiagnostic(self, name, diagnostic, lines=None):
+        """logs a diagnostic and counts it for the check result"""
+        self.checked[diagnostic['level']] += 1
+        self.showDiagnostic(name, diagnostic, lines)
+
+    def showDiagnostic(self, name, diagnostic, lines=None):
+        """logs a diagnostic as name:line: level: message when name is the mml file
+
+        lines in diagnostics are lines in the generated mml, which --check and
+        nsf only builds never write anywhere.  for those pass the lines of the
+        mml and the line itself is shown under the message.  diagnostics with
+        a source_line point at that line in name (song.mmlx:19) with the line
+        in the mml after the message, the others at name (mml line 12)"""
+        log = self.logger.error if diagnostic['level'] == 'error' else self.logger.warning
+        level = self.logger.color('error', self.logger.RED) if diagnostic['level'] == 'error' else self.logger.color('warning', self.logger.YELLOW)
+
+        line = diagnostic['line']
+        if line is None:
+            log('%s: %s: %s', name, level, diagnostic['message'])
+            return
+
+        if lines is None:
+            log('%s:%d: %s: %s', name, line, level, diagnostic['message'])
+            return
+
+        if diagnostic.get('source_line'):
+            log('%s:%d: %s: %s (mml line %d)', name, diagnostic['source_line'], level, diagnostic['message'], line)
+        else:
+            log('%s (mml line %d): %s: %s', name, line, level, diagnostic['message'])
+
+        if line > 0 and line <= len(lines):
+            log('    %s', lines[line - 1].strip())
+
+    def showCheckResult(self):
+        """logs how the check went and returns the exit code"""
+        checked = self.checked
+        color = self.logger.RED if checked['error'] else self.logger.GREEN
+        self.logger.log(self.logger.color('checked %d file%s in %.2fms: %d error%s, %d warning%s' % (
+            checked['files'], '' if checked['files'] == 1 else 's',
+            checked['time'] * 1000,
+            checked['error'], '' if checked['error'] == 1 else 's',
+            checked['warning'], '' if checked['warning'] == 1 else 's'), color))
+
+        return 1 if checked['error'] else 0
+
+    def showSize(self, output, emitter):
+        """logs how big the song is going to be and stops the build if it is over budget"""
+        from .sizereport import SizeReport
+
+        budget = self.options['size_budget']
+        report = SizeReport(emitter.getvalue(), output)
+
+        self.logger.log(self.logger.color('size of ' + output.replace('.mml', '.nsf') + ':', self.logger.WHITE, True))
+        for line in report.render(budget):
+            self.logger.log(line)
+
+        self.logger.log('')
+
+        if report.isOverBudget(budget):
+            emitter.close()
+            raise Exception('%s is %d bytes which is over the budget of %d bytes' % (output.replace('.mml', '.nsf'), report.getTotal(), budget))
+
+    def showProfile(self, input, profiler):
+        import json
+        from .util import Util
+
+        profiler.close()
+        self.assembler.profiler = None
+
+        self.logger.log(self.logger.color('profile for ' + input + ':', self.logger.WHITE, True))
+        for line in profiler.render():
+            self.logger.log(line)
+
+        self.logger.log('')
+
+        if self.options['profile_json'] is None:
+            return
+
+        self.profiles[input] = profiler.toDict()
+        Util.writeFile(self.options['profile_json'], json.dumps(self.profiles, indent=4, sort_keys=True) + '\n')
+
+    def handleProcessedFile(self, emitter, output, open_file=False):
+        from .util import Util
+
         if self.options['create_mml']:
             self.logger.log('generating file: ' + self.logger.color(output, self.logger.YELLOW))
+            if not Util.writeFile(output, emitter):
+                self.logger.debug('- mml is unchanged: %s', output)
 
-        Util.writeFile(output, content)
-
+        # the intermediate mml for the nsf only ever exists in the scratch directory
         if self.options['create_nsf']:
-            self.createNSF(output, open_file)
-
-        if not self.options['create_mml']:
-            Util.removeFile(output)
+            nsf_path = output.replace('.mml', '.nsf')
+            try:
+                self.assembler.createNSF(emitter, nsf_path)
+            finally:
+                # lines are in the mml, which is only written with --create-mml 1,
+                # otherwise the lines come from the mml that was assembled
+                lines = None
+                if not self.options['create_mml'] and len(self.assembler.diagnostics):
+                    lines = emitter.getvalue().splitlines()
+
+                for diagnostic in self.assembler.diagnostics:
+                    self.showDiagnostic(output if lines is None else nsf_path, diagnostic, lines)
+
+            if open_file and self.options['open_nsf']:
+                self.openNSF(nsf_path)
 
         if open_file:
             self.logger.log("")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import tracemalloc
+from timeit import default_timer
+
+
+class Profiler(object):
+    """times the stages of processing a song and keeps counters along the way
+
+    starting a stage ends the one before it.  if a stage runs more than once
+    (such as when processing voices separately) the times are added up.
+
+    with track_memory the memory allocated in each stage is recorded as well
+    using tracemalloc.  this slows everything down so the
+    times are not as accurate."""
+
+    def __init__(self, track_memory=False):
+        # stage names in the order they first ran
+        self.stages = []
+        self.times = {}
+        self.current = None
+        self.started = None
+
+        # stage name => [bytes still allocated at the end, peak bytes]
+        self.memory = {}
+        self.memory_started = None
+        self.started_tracing = False
+        self.track_memory = track_memory
+
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+        # counter names and timings of other things (like subprocesses) in the order they were added
+        self.counters = []
+        self.counts = {}
+        self.durations = []
+        self.duration_times = {}
+
+    def stage(self, name):
+        self.stop()
+
+        if not name in self.times:
+            self.stages.append(name)
+            self.times[name] = 0.0
+            self.memory[name] = [0, 0]
+
+        self.current = name
+
+        if self.track_memory:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+
+            self.memory_started = tracemalloc.get_traced_memory()[0]
+
+        self.started = default_timer()
+
+    def stop(self):
+        if self.current is None:
+            return
+
+        self.times[self.current] += default_timer() - self.started
+
+        if self.track_memory:
+            memory = tracemalloc.get_traced_memory()
+            self.memory[self.current][0] += memory[0] - self.memory_started
+
+            # without reset_peak the peak is for everything so far
+            if hasattr(tracemalloc, 'reset_peak'):
+                self.memory[self.current][1] = max(self.memory[self.current][1], memory[1] - self.memory_started)
+
+        self.current = None
+
+    def count(self, name, amount=1):
+        if not name in self.counts:
+            self.counters.append(name)
+            self.counts[name] = 0
+
+        self.counts[name] += amount
+
+    def addTime(self, name, seconds):
+        if not name in self.duration_times:
+            self.durations.append(name)
+            self.duration_times[name] = 0.0
+
+        self.duration_times[name] += seconds
+
+    def getTimes(self):
+        return [(name, self.times[name]) for name in self.stages]
+
+    def getTotal(self):
+        return sum(self.times.values())
+
+    def toDict(self):
+        stages = []
+        for name in self.stages:
+            stage = {'name': name, 'time': self.times[name]}
+            if self.track_memory:
+                stage['allocated'] = self.memory[name][0]
+                stage['peak'] = self.memory[name][1]
+
+            stages.append(stage)
+
+        return {
+            'stages': stages,
+            'total': self.getTotal(),
+            'counters': dict([(name, self.counts[name]) for name in self.counters]),
+            'durations': dict([(name, self.duration_times[name]) for name in self.durations])
+        }
+
+    def formatTime(self, seconds):
+        return '%10.2fms' % (seconds * 1000)
+
+    def formatBytes(self, count):
+        return '%10.1fkb' % (count / 1024.0)
+
+    def render(self):
+        """returns the lines of a table with everything that was recorded"""
+        lines = []
+        header = '%-32s %12s' % ('stage', 'time')
+        if self.track_memory:
+            header += ' %12s %12s' % ('allocated', 'peak')
+
+        lines.append(header)
+        for name in self.stages:
+            line = '%-32s %12s' % (name, self.formatTime(self.times[name]))
+            if self.track_memory:
+                line += ' %12s %12s' % (self.formatBytes(self.memory[name][0]), self.formatBytes(self.memory[name][1]))
+
+            lines.append(line)
+
+        lines.append('%-32s %12s' % ('total', self.formatTime(self.getTotal())))
+
+        if len(self.durations):
+            lines.append('')
+            for name in self.durations:
+                lines.append('%-32s %12s' % (name, self.formatTime(self.duration_times[name])))
+
+        if len(self.counters):
+            lines.append('')
+            for name in self.counters:
+                lines.append('%-32s %12d' % (name, self.counts[name]))
+
+        return lines
+
+    def close(self):
+        self.stop()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""compile server for editors and other tools that compile over and over
+
+requests and responses are json, one per line.  a request looks like
+
+    {"id": 1, "path": "songs/song.mmlx", "options": {"create_nsf": true}}
+
+or sends the source itself
+
+    {"id": 2, "source": "A o4 c d e", "options": {"separate_voices": true}}
+
+and the response has the mml, nsf data (base64 encoded), per voice output and
+diagnostics
+
+    {"id": 1, "success": true, "mml": "...", "nsf": "...", "voices": {}, "voice_nsfs": {}, "diagnostics": [], "time": 0.012}
+"""
+import base64
+import json
+import os
+import time
+import socketserver
+from .api import Compiler
+
+
+class Server(object):
+
+    # options from the command line that are used for every request
+    DEFAULT_OPTIONS = ['local', 'verbose', 'separate_voices', 'create_nsf', 'import_path', 'check', 'compress_macros', 'size_report', 'size_budget', 'parallel_voices', 'dpcm_cache']
+
+    def __init__(self, options):
+        self.compiler = Compiler(True)
+        self.options = {}
+        for key in Server.DEFAULT_OPTIONS:
+            if key in options:
+                self.options[key] = options[key]
+
+    def encode(self, data):
+        if data is None:
+            return None
+
+        return base64.b64encode(data).decode('ascii')
+
+    def handle(self, request):
+        start = time.time()
+
+        options = self.options.copy()
+        options.update(request.get('options') or {})
+
+        if 'source' in request:
+            if 'path' in request:
+                options['path'] = request['path']
+
+            result = self.compiler.compile(request['source'], None, options)
+        else:
+            result = self.compiler.compileFile(request['path'], options)
+
+        voice_nsfs = {}
+        for voice in result.voice_nsfs:
+            voice_nsfs[voice] = self.encode(result.voice_nsfs[voice])
+
+        return {
+            'id': request.get('id'),
+            'success': result.succeeded(),
+            'mml': result.mml,
+            'nsf': self.encode(result.nsf),
+            'voices': result.voices,
+            'voice_nsfs': voice_nsfs,
+            'diagnostics': result.diagnostics,
+            'profile': result.profile,
+            'size': result.size,
+            'time': round(time.time() - start, 6)
+        }
+
+    def getErrorResponse(self, id, message):
+        return {'id': id, 'success': False, 'diagnostics': [{'level': 'error', 'message': message}]}
+
+    def checkRequest(self, request):
+        if not isinstance(request, dict):
+            raise ValueError('request has to be a json object')
+
+        if not 'source' in request and not 'path' in request:
+            raise ValueError('request needs a source or a path')
+
+        for key in ['source', 'path']:
+            if key in request and not isinstance(request[key], str):
+                raise ValueError(key + ' has to be a string')
+
+        if not isinstance(request.get('options') or {}, dict):
+            raise ValueError('options have to be a json object')
+
+    def handleLine(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return self.getErrorResponse(None, 'invalid request: ' + str(e))
+
+        # the client can still match up the error if the request has an id
+        try:
+            self.checkRequest(request)
+        except ValueError as e:
+            return self.getErrorResponse(request.get('id') if isinstance(request, dict) else None, 'invalid request: ' + str(e))
+
+        # one bad request should never take the server down with it
+        try:
+            return self.handle(request)
+        except Exception as e:
+            return self.getErrorResponse(request.get('id'), str(e))
+
+    def serveStream(self, input, output):
+        """answers requests from input until it is closed"""
+        while True:
+            line = input.readline()
+            if not line:
+                break
+
+            if not line.strip():
+                continue
+
+            output.write(json.dumps(self.handleLine(line)) + '\n')
+            output.flush()
+
+    def serveSocket(self, path):
+        """answers requests on a unix socket at path, one connection at a time"""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.serveStream(TextStream(self.rfile), TextStream(self.wfile))
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+        socket_server = socketserver.UnixStreamServer(path, Handler)
+        try:
+            socket_server.serve_forever()
+        finally:
+            socket_server.server_close()
+            os.unlink(path)
+
+    def close(self):
+        self.compiler.close()
+
+
+class TextStream(object):
+    """reads and writes text on a socket file which works with bytes on python 3"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readline(self):
+        line = self.stream.readline()
+        return line.decode('utf-8') if not isinstance(line, str) else line
+
+    def write(self, data):
+        self.stream.write(data.encode('utf-8'))
+
+    def flush(self):
+        self.stream.flush()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from .validator import Validator
+
+
+class SizeReport(object):
+    """estimates how many bytes of driver data the mml for a song turns into
+
+    these are estimates of what ppmckc writes, not exact counts: a note or rest
+    is a byte for the note and a byte for the length, a command with a value
+    is two bytes, loops cost a few bytes for the count and where to jump back
+    to and octave and length changes are free since ppmckc works them out.
+    envelope macros are a byte per value plus the end and loop point.  dpcm
+    samples are not counted.
+    """
+
+    # kind of macro => name shown in the report
+    MACRO_NAMES = {
+        '': 'duty (@)',
+        'v': 'volume (@v)',
+        'EP': 'pitch (@EP)',
+        'EN': 'arpeggio (@EN)',
+        'MP': 'vibrato (@MP)',
+        'MH': 'hardware sweep (@MH)',
+        'N': 'N106 waveform (@N)',
+        'FM': 'FDS waveform (@FM)',
+        'OP': 'VRC7 patch (@OP)',
+        'DPCM': 'dpcm (@DPCM)'
+    }
+
+    # bytes for each kind of token in a voice
+    TOKEN_BYTES = {
+        'note': 2,
+        'rest': 2,
+        'tie': 2,
+        'value': 2,
+        'macro': 2,
+        'command': 1,
+        'loop_end': 4,
+        'loop_break': 3,
+        'repeat_end': 4
+    }
+
+    # the end of every voice and the jump back to its loop point
+    VOICE_END_BYTES = 3
+
+    def __init__(self, mml, name=None):
+        self.name = name
+
+        # voice => bytes in the order voices first show up
+        self.voices = []
+        self.voice_bytes = {}
+
+        # (macro name, kind, bytes) in the order they are defined
+        self.macros = []
+
+        self.measure(mml)
+
+    def getMacroBytes(self, kind, content):
+        values = [value for value in content.replace(',', ' ').split() if value != '|']
+
+        # waveforms have two samples in a byte and a byte for where they go
+        if kind == 'N':
+            return len(values[1:]) // 2 + 1
+
+        if kind in ('FM', 'OP', 'DPCM', 'MP'):
+            return len(values)
+
+        return len(values) + 2
+
+    def addVoiceBytes(self, voice, count):
+        if not voice in self.voice_bytes:
+            self.voices.append(voice)
+            self.voice_bytes[voice] = SizeReport.VOICE_END_BYTES
+
+        self.voice_bytes[voice] += count
+
+    def measureVoice(self, music):
+        count = 0
+        for match in Validator.TOKENS.finditer(music):
+            kind = match.lastgroup
+            if kind in ('macro_kind', 'macro_number'):
+                kind = 'macro'
+
+            count += SizeReport.TOKEN_BYTES.get(kind, 0)
+
+        return count
+
+    def measure(self, mml):
+        # (name, kind, content) of a macro that continues on the next lines
+        open_macro = None
+
+        for line in mml.splitlines():
+            line = line.strip()
+
+            if open_macro is not None:
+                open_macro = (open_macro[0], open_macro[1], open_macro[2] + ' ' + line)
+                if '}' in line:
+                    self.macros.append((open_macro[0], open_macro[1], self.getMacroBytes(open_macro[1], open_macro[2].split('}')[0])))
+                    open_macro = None
+                continue
+
+            if not line or line.startswith('#'):
+                continue
+
+            match = Validator.MACRO_LINE.match(line)
+            if match:
+                name = '@' + match.group(1) + match.group(2)
+                if not '}' in match.group(3):
+                    open_macro = (name, match.group(1), match.group(3))
+                    continue
+
+                self.macros.append((name, match.group(1), self.getMacroBytes(match.group(1), match.group(3).split('}')[0])))
+                continue
+
+            match = Validator.VOICE_LINE.match(line)
+            if not match:
+                continue
+
+            # a line for more than one voice is written out for each of them
+            count = self.measureVoice(match.group(3) or '')
+            for voice in match.group(1):
+                self.addVoiceBytes(voice, count)
+
+    def getVoiceTotal(self):
+        return sum(self.voice_bytes.values())
+
+    def getMacroTotal(self):
+        return sum([macro[2] for macro in self.macros])
+
+    def getTotal(self):
+        return self.getVoiceTotal() + self.getMacroTotal()
+
+    def getMacroKinds(self):
+        """returns (kind, number of macros, bytes) for every kind of macro in the song"""
+        kinds = []
+        totals = {}
+        for macro in self.macros:
+            if not macro[1] in totals:
+                kinds.append(macro[1])
+                totals[macro[1]] = [0, 0]
+
+            totals[macro[1]][0] += 1
+            totals[macro[1]][1] += macro[2]
+
+        return [(kind, totals[kind][0], totals[kind][1]) for kind in kinds]
+
+    def getBiggest(self, count=5):
+        """returns (name, bytes) for the voices and macros taking up the most space"""
+        items = [('voice ' + voice, self.voice_bytes[voice]) for voice in self.voices]
+        items += [(macro[0], macro[2]) for macro in self.macros]
+        return sorted(items, key=lambda item: -item[1])[:count]
+
+    def toDict(self):
+        return {
+            'total': self.getTotal(),
+            'voices': dict([(voice, self.voice_bytes[voice]) for voice in self.voices]),
+            'macros': dict([(macro[0], macro[2]) for macro in self.macros])
+        }
+
+    def formatBytes(self, count):
+        return '%8d bytes' % count
+
+    def render(self, budget=None):
+        """returns the lines of a table with the size of each voice and kind of macro"""
+        lines = []
+        lines.append('%-32s %14s' % ('voices', self.formatBytes(self.getVoiceTotal())))
+        for voice in self.voices:
+            lines.append('%-32s %14s' % ('  ' + voice, self.formatBytes(self.voice_bytes[voice])))
+
+        lines.append('%-32s %14s' % ('macros', self.formatBytes(self.getMacroTotal())))
+        for kind in self.getMacroKinds():
+            lines.append('%-32s %14s' % ('  %s x%d' % (SizeReport.MACRO_NAMES[kind[0]], kind[1]), self.formatBytes(kind[2])))
+
+        total = 'total'
+        if budget is not None:
+            total += ' (budget %d, %.0f%%)' % (budget, self.getTotal() * 100.0 / budget)
+
+        lines.append('%-32s %14s' % (total, self.formatBytes(self.getTotal())))
+
+        biggest = self.getBiggest()
+        if len(biggest):
+            lines.append('')
+            lines.append('biggest: ' + ', '.join(['%s (%d)' % item for item in biggest]))
+
+        return lines
+
+    def isOverBudget(self, budget):
+        return budget is not None and self.getTotal() > budget
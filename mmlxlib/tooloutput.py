@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import re
+
+
+class ToolOutput(object):
+    """what ppmckc or nesasm printed while building a song
+
+    the output is split into diagnostics like the ones from Validator: a
+    dictionary with the line in the mml (or None), the level ('error' or
+    'warning') and a message.  ppmckc reports the line in the mml it was given
+    so its messages map straight back to it.  nesasm only knows about the
+    assembly ppmckc generated so its messages say where in the assembly they
+    are instead.
+    """
+
+    ERROR = 'error'
+    WARNING = 'warning'
+
+    # Error  : song.mml     12: message
+    PPMCKC_LINE_MESSAGE = re.compile(r'^(Error|Warning)\s*:\s*(.*?)\s+(\d+):\s*(.*)$')
+
+    # Error  : message
+    PPMCKC_MESSAGE = re.compile(r'^(Error|Warning)\s*:\s*(.*)$')
+
+    # #[2]   song.h (the file the lines after it are from)
+    NESASM_FILE = re.compile(r'^#\[\d+\]\s+(.*)$')
+
+    #   123  00:8000  lda foo (a line of the listing)
+    NESASM_LISTING = re.compile(r'^\s*(\d+)\s+[0-9A-Fa-f]{2}:[0-9A-Fa-f]{4}')
+
+    # # 2 error(s)
+    NESASM_SUMMARY = re.compile(r'^# \d+ error\(s\)')
+
+    def __init__(self, command, exit_status, output, seconds, mml_path=None):
+        self.name = os.path.basename(command[0])
+        self.exit_status = exit_status
+        self.output = output
+        self.seconds = seconds
+
+        # the mml file the lines in the diagnostics are in
+        self.mml_path = mml_path
+
+        self.diagnostics = []
+        if self.name.startswith('nesasm'):
+            self.parseNesasm()
+        else:
+            self.parsePpmckc()
+
+    def add(self, line, level, message):
+        self.diagnostics.append({'line': line, 'level': level, 'message': self.name + ': ' + message})
+
+    def getLevel(self, word):
+        return ToolOutput.WARNING if word.lower().startswith('warning') else ToolOutput.ERROR
+
+    def parsePpmckc(self):
+        for line in self.output.splitlines():
+            line = line.strip()
+            match = ToolOutput.PPMCKC_LINE_MESSAGE.match(line)
+            if match:
+                # messages about a file the mml includes can't be mapped back to a line
+                if self.mml_path is None or os.path.basename(match.group(2)) == os.path.basename(self.mml_path):
+                    self.add(int(match.group(3)), self.getLevel(match.group(1)), match.group(4))
+                else:
+                    self.add(None, self.getLevel(match.group(1)), match.group(4) + ' (' + match.group(2) + ' line ' + match.group(3) + ')')
+                continue
+
+            match = ToolOutput.PPMCKC_MESSAGE.match(line)
+            if match and match.group(2):
+                self.add(None, self.getLevel(match.group(1)), match.group(2))
+
+    def parseNesasm(self):
+        file = None
+        number = None
+        for line in self.output.splitlines():
+            match = ToolOutput.NESASM_FILE.match(line)
+            if match:
+                file = match.group(1).strip()
+                continue
+
+            match = ToolOutput.NESASM_LISTING.match(line)
+            if match:
+                number = match.group(1)
+                continue
+
+            # every message nesasm has ends with !
+            message = line.strip()
+            if not message.endswith('!') or ToolOutput.NESASM_SUMMARY.match(message):
+                continue
+
+            if file is not None and number is not None:
+                message += ' (' + os.path.basename(file) + ' line ' + number + ')'
+
+            self.add(None, self.getLevel(message), message)
+            number = None
+
+    def getErrors(self):
+        return [diagnostic for diagnostic in self.diagnostics if diagnostic['level'] == ToolOutput.ERROR]
+
+    def failed(self):
+        return self.exit_status != 0 or len(self.getErrors()) > 0
+
+    def getSummary(self):
+        """returns why the command failed"""
+        if self.exit_status < 0:
+            return self.name + ' was killed by signal ' + str(-self.exit_status)
+
+        if self.exit_status != 0:
+            return self.name + ' failed with exit status ' + str(self.exit_status)
+
+        count = len(self.getErrors())
+        return self.name + ' reported ' + str(count) + ' error' + ('' if count == 1 else 's')
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2012 Craig Campbell
 #
@@ -13,8 +13,12 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import filecmp
 import operator
 import os
+import shutil
+import stat
+import tempfile
 
 
 class Util(object):
@@ -33,16 +37,138 @@ class Util(object):
 
     @staticmethod
     def openFile(path):
-        file = open(path, "r")
+        file = open(path, "r", encoding="utf-8")
         content = file.read()
         file.close()
         return content
 
     @staticmethod
-    def writeFile(path, content):
-        file = open(path, "w")
+    def writeFile(path, content, atomic=True):
+        """writes content (a string or an emitter) to path
+
+        by default the content goes into a temporary file in the same directory
+        first which is synced to disk and renamed over the destination, so
+        anyone reading the destination sees either the old file or the new one.
+        returns False if the destination already had the same content, in
+        which case nothing is synced to disk."""
+        if not atomic:
+            file = open(path, "w", encoding="utf-8")
+            Util.writeContent(file, content)
+            file.close()
+            return True
+
+        temp_path = Util.createTempFileFor(path)
+        file = None
+        try:
+            file = open(temp_path, "w", encoding="utf-8")
+            Util.writeContent(file, content)
+        except:
+            if file is not None:
+                file.close()
+            os.unlink(temp_path)
+            raise
+
+        return Util.replaceFile(temp_path, path, file)
+
+    @staticmethod
+    def writeContent(file, content):
+        # an emitter writes its sections straight into the file
+        if hasattr(content, 'writeTo'):
+            content.writeTo(file)
+            return
+
         file.write(content)
-        file.close()
+
+    @staticmethod
+    def moveFile(path, destination):
+        """moves a file so the destination is replaced in one step
+
+        the file is copied next to the destination first since the source can
+        be on a different file system (such as a scratch directory in tmpfs).
+        returns False if the destination already had the same content."""
+        temp_path = Util.createTempFileFor(destination)
+        try:
+            source = open(path, "rb")
+            file = open(temp_path, "wb")
+            shutil.copyfileobj(source, file)
+            source.close()
+        except:
+            os.unlink(temp_path)
+            raise
+
+        os.unlink(path)
+        return Util.replaceFile(temp_path, destination, file)
+
+    @staticmethod
+    def createTempFileFor(path):
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+        os.close(handle)
+
+        # mkstemp only gives the owner access, use what a regular open would
+        os.chmod(temp_path, Util.getFileMode(path))
+        return temp_path
+
+    @staticmethod
+    def getFileMode(path):
+        if os.path.isfile(path):
+            return stat.S_IMODE(os.stat(path).st_mode)
+
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+    @staticmethod
+    def syncFile(file):
+        file.flush()
+        os.fsync(file.fileno())
+
+    @staticmethod
+    def replaceFile(temp_path, path, file=None):
+        """renames temp_path over path unless they are identical
+
+        file is the temporary file if it is still open.  it is only synced to
+        disk once we know it is going to replace path"""
+        try:
+            if file is not None:
+                file.flush()
+
+            if os.path.isfile(path) and filecmp.cmp(temp_path, path, False):
+                if file is not None:
+                    file.close()
+                os.unlink(temp_path)
+                return False
+
+            if file is not None:
+                Util.syncFile(file)
+                file.close()
+
+            # replaces path in one step on windows too, unlike os.rename
+            os.replace(temp_path, path)
+        except:
+            if file is not None:
+                file.close()
+            if os.path.isfile(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        Util.syncDirectory(os.path.dirname(os.path.abspath(path)))
+        return True
+
+    @staticmethod
+    def syncDirectory(path):
+        # makes sure the rename itself survives a crash, not every platform can do this
+        try:
+            handle = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+
+        try:
+            os.fsync(handle)
+        except OSError:
+            pass
+        finally:
+            os.close(handle)
 
     @staticmethod
     def removeFile(path):
@@ -50,7 +176,7 @@ class Util(object):
 
     @staticmethod
     def sortDictionary(dictionary):
-        return sorted(dictionary.iteritems(), key=operator.itemgetter(1))
+        return sorted(dictionary.items(), key=operator.itemgetter(1))
 
     @staticmethod
     def isFileOrDirectory(path):
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+from .instrument import Instrument
+
+
+class Validator(object):
+    """checks generated mml for mistakes ppmckc would choke on without running it
+
+    validate() returns a list of diagnostics, each a dictionary with the line
+    (in the mml), level ('error' or 'warning') and a message.
+    """
+
+    ERROR = 'error'
+    WARNING = 'warning'
+
+    # voices every song has and the voices each expansion chip adds
+    VOICES = 'ABCDE'
+    CHIP_VOICES = {
+        'EX-DISKFM': 'F',
+        'EX-VRC7': 'GHIJKL',
+        'EX-VRC6': 'MNO',
+        'EX-MMC5': 'XY',
+        'EX-FME7': 'XYZ'
+    }
+    N106_VOICES = 'PQRSTUVW'
+
+    # octaves ppmck has frequencies for
+    MIN_OCTAVE = 0
+    MAX_OCTAVE = 9
+
+    GLOBAL_LINE = re.compile(r'^#([-A-Z0-9]+)\s*(.*)$')
+    MACRO_LINE = re.compile(r'^@(v|EP|EN|MP|MH|N|FM|OP|DPCM|)(\d+)\s*=\s*\{(.*)$')
+    VOICE_LINE = re.compile(r'^([A-Z]+)(\s+(.*))?$')
+
+    # everything that can be in a voice, kind => regex
+    TOKENS = re.compile(r'''
+        (?P<note>[a-g][-+\#]*\d*\.*)
+        |(?P<rest>[rw]\d*\.*)
+        |(?P<tie>\^\d*\.*|&)
+        |(?P<length>l\d+\.*)
+        |(?P<octave>o(?P<octave_value>\d+))
+        |(?P<shift>[<>])
+        |(?P<repeat_start>\|:)
+        |(?P<repeat_end>:\|\d*)
+        |(?P<loop_start>\[)
+        |(?P<loop_end>\]\d*)
+        |(?P<loop_break>\|)
+        |(?P<command>EPOF|ENOF|MPOF|MHOF|SDOF|SDQR|SMOF|EHOF|SM|PS|L|!)
+        |(?P<macro>(?P<macro_kind>@@|@vr|@v|EN|EP|MP|MH)(?P<macro_number>\d+))
+        |(?P<value>(?:@q|@|t|q|SD|D|k|x|n)\d+|v[-+]?\d+|v[-+]|s\d+(?:,\d+)?|y\d+,\d+)
+        |(?P<tuplet>[{}])
+    ''', re.VERBOSE)
+
+    # what each macro in a voice refers to
+    MACRO_NAMES = {'@@': '', '@vr': 'v', '@v': 'v', 'EN': 'EN', 'EP': 'EP', 'MP': 'MP', 'MH': 'MH'}
+
+    def __init__(self):
+        self.diagnostics = []
+
+    def add(self, line, level, message):
+        self.diagnostics.append({'line': line, 'level': level, 'message': message})
+
+    def getVoices(self, globals):
+        voices = Validator.VOICES
+        for chip in Validator.CHIP_VOICES:
+            if chip in globals:
+                voices += Validator.CHIP_VOICES[chip]
+
+        if 'EX-NAMCO106' in globals:
+            count = 1
+            try:
+                count = int(globals['EX-NAMCO106'] or 1)
+            except ValueError:
+                pass
+
+            voices += Validator.N106_VOICES[:count]
+
+        return voices
+
+    def validateMacro(self, number, kind, content):
+        """checks the values of waveform macros like Macros.renderLines does"""
+        content = content.strip()
+        try:
+            if kind == 'N':
+                bits = content.split(',')
+                if len(bits) != 2:
+                    raise Exception('N106 waveform needs a buffer and samples: { 00, 0 1 2 3 }')
+
+                waveform = Instrument.validateN106(bits[1])
+                if int(bits[0]) > Instrument.maxBufferFromSampleLength(len(waveform.split())):
+                    raise Exception('buffer value cannot be greater than: ' + str(Instrument.maxBufferFromSampleLength(len(waveform.split()))))
+
+            if kind == 'FM':
+                Instrument.validateFds(' '.join(content.split()))
+        except KeyError:
+            self.add(number, Validator.ERROR, 'N106 waveform can only have 4, 8, 12, 16, 20, 24, 28 or 32 samples')
+        except Exception as e:
+            self.add(number, Validator.ERROR, str(e))
+
+    def getMacroName(self, kind, voice):
+        if kind != '@@':
+            return Validator.MACRO_NAMES[kind]
+
+        # @@ picks a waveform on expansion chips and a duty envelope everywhere else
+        if voice in Validator.N106_VOICES:
+            return 'N'
+
+        if voice == 'F':
+            return 'FM'
+
+        return ''
+
+    def validateVoice(self, number, voices, music, state):
+        position = 0
+        length = len(music)
+        while position < length:
+            if music[position].isspace():
+                position += 1
+                continue
+
+            match = Validator.TOKENS.match(music, position)
+            if match is None:
+                end = position
+                while end < length and not music[end].isspace():
+                    end += 1
+
+                self.add(number, Validator.ERROR, 'unknown command ' + music[position:end])
+                position = end
+                continue
+
+            position = match.end()
+            kind = match.lastgroup
+            if kind in ('octave_value', 'macro_kind', 'macro_number'):
+                kind = 'octave' if kind == 'octave_value' else 'macro'
+
+            for voice in voices:
+                self.applyToken(number, voice, kind, match, state)
+
+    def applyToken(self, number, voice, kind, match, state):
+        octaves = state['octaves']
+        loops = state['loops'].setdefault(voice, [])
+
+        if kind == 'octave':
+            octave = int(match.group('octave_value'))
+            if octave < Validator.MIN_OCTAVE or octave > Validator.MAX_OCTAVE:
+                self.add(number, Validator.ERROR, 'octave o' + str(octave) + ' is out of range for ' + voice + ' (o' + str(Validator.MIN_OCTAVE) + ' to o' + str(Validator.MAX_OCTAVE) + ')')
+
+            octaves[voice] = octave
+            return
+
+        if kind == 'shift':
+            if voice in octaves:
+                octaves[voice] += 1 if match.group(0) == '>' else -1
+                self.checkOctave(number, voice, octaves[voice], state)
+            return
+
+        # ppmckc reads a loop once so octave changes inside it only count once
+        if kind == 'loop_start' or kind == 'repeat_start':
+            loops.append(match.group(0))
+            return
+
+        if kind == 'loop_end' or kind == 'repeat_end':
+            opening = '[' if kind == 'loop_end' else '|:'
+            if not len(loops) or loops[-1] != opening:
+                self.add(number, Validator.ERROR, match.group(0) + ' without a matching ' + opening + ' in ' + voice)
+                return
+
+            loops.pop()
+            return
+
+        if kind == 'loop_break':
+            if not len(loops) or loops[-1] != '[':
+                self.add(number, Validator.ERROR, '| outside of a [ ] loop in ' + voice)
+            return
+
+        if kind == 'macro':
+            name = self.getMacroName(match.group('macro_kind'), voice)
+            key = '@' + name + match.group('macro_number')
+            if not key in state['used']:
+                state['used'][key] = number
+
+    def checkOctave(self, number, voice, octave, state):
+        if octave >= Validator.MIN_OCTAVE and octave <= Validator.MAX_OCTAVE:
+            return
+
+        # only warn once for each voice, one mistake tends to push everything after it out of range
+        if voice in state['octave_warnings']:
+            return
+
+        state['octave_warnings'].add(voice)
+        self.add(number, Validator.WARNING, 'octave goes to o' + str(octave) + ' in ' + voice + ' which is out of range')
+
+    def validate(self, mml):
+        self.diagnostics = []
+        lines = mml.splitlines()
+
+        globals = {}
+        for line in lines:
+            match = Validator.GLOBAL_LINE.match(line.strip())
+            if match:
+                globals[match.group(1)] = match.group(2)
+
+        supported = self.getVoices(globals)
+
+        # macro name => line it was defined on and macro name => first line that uses it
+        defined = {}
+        state = {'octaves': {}, 'loops': {}, 'used': {}, 'octave_warnings': set()}
+
+        # (line number, kind, content) of a macro that continues on the next lines
+        open_macro = None
+
+        for key, line in enumerate(lines):
+            number = key + 1
+            line = line.strip()
+
+            if open_macro is not None:
+                open_macro = (open_macro[0], open_macro[1], open_macro[2] + ' ' + line)
+                if '}' in line:
+                    self.validateMacro(open_macro[0], open_macro[1], open_macro[2].split('}')[0])
+                    open_macro = None
+                continue
+
+            if not line or line.startswith('#'):
+                continue
+
+            match = Validator.MACRO_LINE.match(line)
+            if match:
+                name = '@' + match.group(1) + match.group(2)
+                if name in defined:
+                    self.add(number, Validator.WARNING, 'macro ' + name + ' is already defined on line ' + str(defined[name]))
+
+                defined[name] = number
+                if not '}' in match.group(3):
+                    open_macro = (number, match.group(1), match.group(3))
+                    continue
+
+                self.validateMacro(number, match.group(1), match.group(3).split('}')[0])
+                continue
+
+            match = Validator.VOICE_LINE.match(line)
+            if not match:
+                self.add(number, Validator.ERROR, 'expected a voice, a macro or a # declaration: ' + line)
+                continue
+
+            voices = match.group(1)
+            unsupported = [voice for voice in voices if not voice in supported]
+            if len(unsupported):
+                self.add(number, Validator.ERROR, 'voice ' + ', '.join(unsupported) + ' is not available, the chips in this song have ' + supported)
+
+            self.validateVoice(number, voices, match.group(3) or '', state)
+
+        if open_macro is not None:
+            self.add(open_macro[0], Validator.ERROR, 'macro is missing a closing }')
+
+        for voice in sorted(state['loops']):
+            for loop in state['loops'][voice]:
+                self.add(len(lines), Validator.ERROR, loop + ' is never closed in ' + voice)
+
+        for name in sorted(state['used'], key=state['used'].get):
+            if not name in defined:
+                self.add(state['used'][name], Validator.ERROR, 'macro ' + name + ' is used but never defined')
+
+        self.diagnostics.sort(key=lambda diagnostic: diagnostic['line'])
+        return self.diagnostics
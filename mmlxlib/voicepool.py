@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+# Copyright 2012 Craig Campbell
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import re
+import array
+import multiprocessing
+from .warpwhistle import WarpWhistle
+
+
+def processGroup(indexes):
+    """runs in a worker process, see VoicePool.processGroup"""
+    return VoicePool.current.processGroup(indexes)
+
+
+class VoicePool(object):
+    """processes the body of a song in worker processes, one group of voices in each
+
+    voices only depend on each other through lines they share, so voices that
+    share a line that reads what came before it (notes, instruments, slides,
+    octave shifts and loops) go in the same group.  lines that only set things
+    (like ABCDE t150 o4) are processed in every group they touch.  workers are
+    forked after the header is processed so they start with the same state,
+    and macros they create get placeholders that are numbered in the order
+    they show up in the song, which is the order processing them one line at
+    a time would have numbered them in.
+    """
+
+    PLACEHOLDER = re.compile('\x01(\\w+):(\\d+)\x01')
+
+    # the pool processing lines, workers get it when they are forked
+    current = None
+
+    def __init__(self, whistle, processes):
+        self.whistle = whistle
+        self.processes = processes
+
+        # the song and where each line of the body starts, lines are only
+        # sliced out of the song when they are looked at
+        self.content = ''
+        self.starts = array.array('q')
+
+    @staticmethod
+    def getContext():
+        """returns what to make the pool with, or None if processes can't be forked"""
+        if not hasattr(os, 'fork'):
+            return None
+
+        if hasattr(multiprocessing, 'get_context'):
+            return multiprocessing.get_context('fork')
+
+        return multiprocessing
+
+    def findLines(self, content, start):
+        starts = array.array('q', [start])
+        position = content.find('\n', start)
+        while position >= 0:
+            starts.append(position + 1)
+            position = content.find('\n', position + 1)
+
+        self.content = content
+        self.starts = starts
+
+    def getLine(self, index):
+        """returns line index of the body ready to be processed"""
+        start = self.starts[index]
+        end = self.starts[index + 1] - 1 if index + 1 < len(self.starts) else len(self.content)
+        return self.whistle.prepareLine(self.content[start:end])
+
+    def iterLines(self):
+        for index in range(len(self.starts)):
+            yield self.getLine(index)
+
+    def readsState(self, word):
+        """whether what a word turns into depends on the lines before it"""
+        return (self.whistle.isNoteWord(word) or
+                WarpWhistle.SLIDE_WORD.match(word) is not None or
+                WarpWhistle.OCTAVE_SHIFT_WORD.match(word) is not None or
+                WarpWhistle.INSTRUMENT_WORD.match(word) is not None or
+                WarpWhistle.LOOP_MARKER.search(word) is not None)
+
+    def getGroups(self, lines):
+        """returns a list of line indexes for each group of voices"""
+        # voice => voice it is grouped with
+        parents = {}
+
+        def find(voice):
+            parents.setdefault(voice, voice)
+            while parents[voice] != voice:
+                voice = parents[voice]
+            return voice
+
+        # (voices, whether the line only sets things) for each line
+        touched = []
+        current_voices = list(self.whistle.current_voices)
+        for line in lines:
+            voices = []
+            shared = True
+            for word in line.split(' '):
+                if not word or word in WarpWhistle.COMMANDS:
+                    continue
+
+                if WarpWhistle.VOICE_WORD.match(word):
+                    current_voices = list(word)
+                elif self.readsState(word):
+                    shared = False
+
+                voices += [voice for voice in current_voices if not voice in voices]
+
+            for voice in voices:
+                find(voice)
+
+            if not shared:
+                for voice in voices[1:]:
+                    parents[find(voice)] = find(voices[0])
+
+            touched.append((voices, shared))
+
+        # groups are in the order their voices first show up so they come out the same every time
+        groups = {}
+        order = []
+        for key, line in enumerate(touched):
+            roots = []
+            for voice in line[0]:
+                root = find(voice)
+                if not root in roots:
+                    roots.append(root)
+
+            # lines without voices don't change anything, the first group takes them
+            if not len(roots):
+                roots = [None]
+
+            for root in roots:
+                if not root in groups:
+                    order.append(root)
+                groups.setdefault(root, []).append(key)
+
+        if None in groups and len(groups) > 1:
+            order.remove(None)
+            groups[order[0]] = sorted(groups[order[0]] + groups.pop(None))
+
+        return [groups[root] for root in order]
+
+    def processGroup(self, indexes):
+        """processes the lines for one group and returns the lines, the macros
+        behind the placeholders, how many times macros were asked for and the
+        messages logged along the way"""
+        whistle = self.whistle
+
+        # workers don't write anything themselves, the parent logs their
+        # messages in the order of the groups once they are all done
+        messages = []
+        whistle.logger.emit = lambda level, message: messages.append((level, message))
+
+        macros = whistle.macros
+        macros.usePlaceholders()
+        start = macros.getCount() + macros.deduplicated
+
+        lines = {}
+        for index in indexes:
+            lines[index] = whistle.finishLine(whistle.processLine(self.getLine(index)))
+
+        return (lines, macros.getPlaceheld(), macros.getCount() + macros.deduplicated - start, messages)
+
+    def emitLines(self, emitter, section, content, start=0):
+        """processes the lines of content from start on like
+        WarpWhistle.emitLines, returns False if there is nothing to run in
+        parallel"""
+        first_line = content.count('\n', 0, start)
+
+        context = VoicePool.getContext()
+        if context is None:
+            return False
+
+        self.findLines(content, start)
+        groups = self.getGroups(self.iterLines())
+        if len(groups) < 2:
+            return False
+
+        VoicePool.current = self
+
+        # each group gets a fresh fork so state from one group can't leak into another
+        pool = context.Pool(min(self.processes, len(groups)), maxtasksperchild=1)
+        try:
+            results = pool.map(processGroup, groups, 1)
+        finally:
+            VoicePool.current = None
+            pool.terminate()
+            pool.join()
+
+        for result in results:
+            for message in result[3]:
+                self.whistle.logger.emit(message[0], message[1])
+
+        # the first group that processed each line
+        owners = {}
+        for key, group in enumerate(groups):
+            for index in group:
+                owners.setdefault(index, key)
+
+        macros = self.whistle.macros
+        count = macros.getCount()
+        deduplicated = macros.deduplicated
+
+        for index in range(len(self.starts)):
+            result = results[owners[index]]
+            placeheld = result[1]
+
+            line = VoicePool.PLACEHOLDER.sub(lambda match: str(macros.getNumberFor(match.group(1), placeheld[match.group(1)][int(match.group(2))])), result[0][index])
+
+            # blank lines are not needed
+            if line.strip():
+                emitter.addLine(section, line, self.whistle.getSourceLine(first_line + index))
+
+        # count macros asked for that already existed the same way processing one line at a time does
+        requested = sum([result[2] for result in results])
+        macros.deduplicated = deduplicated + requested - (macros.getCount() - count)
+
+        return True
+
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2012 Craig Campbell
 #
@@ -16,8 +16,13 @@
 import re
 import os
 import math
-from util import Util
-from instrument import Instrument
+import copy
+from .util import Util
+from .instrument import Instrument
+from .emitter import Emitter
+from .macros import Macros
+from .importer import Importer
+from .linemap import LineMap
 
 
 class WarpWhistle(object):
@@ -28,6 +33,9 @@ class WarpWhistle(object):
     INSTRUMENT = 'instrument'
     PITCH = 'pitch'
     OCTAVE = 'octave'
+    OCTAVE_OFFSET = 'octave offset'
+    LOOP_OCTAVES = 'loop octaves'
+    VOICE_TRANSPOSE = 'transpose'
     SLIDE = 'slide'
     Q = 'q'
 
@@ -45,6 +53,92 @@ class WarpWhistle(object):
     CHIP_FDS = 'FDS'
     CHIP_VRC6 = 'VRC6'
 
+    GLOBAL_LINE = re.compile(r'^#[-A-Z0-9]+( .*)?$', re.MULTILINE)
+    SPACES = re.compile(' {2,}')
+    OCTAVE_SHIFTS = ['><', '> <', '<>', '< >']
+
+    # quoted strings on one line, /* block comments */, ; and // comments (with
+    # the spaces before them) and runs of new lines
+    COMMENT_TOKENS = re.compile(r'"[^"\n]*"|\'[^\'\n]*\'|/\*.*?\*/| *(?:;|//)[^\n]*|\n+', re.DOTALL)
+
+    # first characters of the words that can only be notes or instruments
+    NOTE_STARTS = frozenset('abcdefg[')
+
+    # note => semitones above c and the other way around
+    NOTE_NUMBERS = {
+        'c': 0,
+        'c+': 1,
+        'd-': 1,
+        'd': 2,
+        'd+': 3,
+        'e-': 3,
+        'e': 4,
+        'f-': 4,
+        'e+': 5,
+        'f': 5,
+        'f+': 6,
+        'g-': 6,
+        'g': 7,
+        'g+': 8,
+        'a-': 8,
+        'a': 9,
+        'a+': 10,
+        'b-': 10,
+        'b': 11
+    }
+
+    NUMBER_NOTES = {
+        0: 'c',
+        1: 'c+',
+        2: 'd',
+        3: 'd+',
+        4: 'e',
+        5: 'f',
+        6: 'f+',
+        7: 'g',
+        8: 'g+',
+        9: 'a',
+        10: 'a+',
+        11: 'b'
+    }
+
+    # ppmck commands that are passed through as they are
+    COMMANDS = ['EPOF', 'ENOF', 'MPOF', 'PS', 'SDQR', 'SDOF', 'MHOF', 'SM', 'SMOF', 'EHOF']
+
+    # words processWord looks for
+    VOICE_WORD = re.compile(r'[A-Z]{1,}$')
+    SLIDE_WORD = re.compile(r'^\/([0-9]+)?$')
+    TEMPO_WORD = re.compile(r't\d+$')
+    VOLUME_WORD = re.compile(r'@v\d+$')
+    TIMBRE_WORD = re.compile(r'@@\d+$')
+    ARPEGGIO_WORD = re.compile(r'EN\d+$')
+    PITCH_WORD = re.compile(r'EP\d+$')
+    Q_WORD = re.compile(r'q[0-8]$')
+    DIRECT_TIMBRE_WORD = re.compile(r'@\d+$')
+    OCTAVE_WORD = re.compile(r'o\d+$')
+    OCTAVE_SHIFT_WORD = re.compile(r'\>+|\<+$')
+    TRANSPOSE_WORD = re.compile(r'KT([-+]?\d+)$')
+    LOOP_MARKER = re.compile(r'[\[\]|]')
+    LOOP_END = re.compile(r'\][^\]]*')
+    # patterns for the stages before the lines are processed and for slides
+    GLOBAL_VARIABLE = re.compile(r'(^#([-A-Z0-9]+)( {1,}(.*))?\n)', re.MULTILINE)
+    LOCAL_VARIABLE = re.compile(r'(^([a-zA-Z]{1}([a-zA-Z0-9_]+)?)\s{0,}=\s{0,}(.*)\n)', re.MULTILINE)
+    RESERVED_VARIABLE = re.compile(r'([A-Z]{1,2}|v\d+|r\d+|w\d+|EP\d+|EN\d+|SD\d+)$')
+    INSTRUMENT_BLOCK = re.compile(r'(^([a-zA-Z0-9-_]+):( {0,}(\n( {4}|\t)(.*))+)\n)', re.MULTILINE)
+    EXTENDS_LINE = re.compile(r'^@extends {1,}(\'|\")(.*)(\1)$')
+    EXPANSION_VOICE = re.compile(r'((N106|FDS|VRC6)-([A-Z]+) )')
+    VOICE_DECLARATION = re.compile(r'^([A-Z]{1,}) ', re.MULTILINE)
+
+    # a variable used in the song, between spaces or in a loop
+    VARIABLE_USE = r'((?<=\s)|(?<=\[))%s(?=\s|\Z|\])'
+    SLIDE_START = re.compile(r'^(\[+)?([a-g](\+|\-)?)(.*)$')
+    SLIDE_END = re.compile(r'(.*)(\](.*))')
+    DMC_WORD = re.compile(r'(\{\s{0,})?(\'|\")(.*\.(dmc|wav))(\2)\s{0,},')
+    DMC_RATE = re.compile(r'\d+')
+    ABSOLUTE_NOTE_WORD = re.compile(r'(\[+)?([A-Ga-g]{1})(\+|\-)?(\d{1,2})?(,(\d+\.?)(\^[0-9\^]+)?)?([\]\d]+)?$')
+    NOTE_WORD = re.compile(r'(\[+)?([a-g]{1}(\+|\-)?)([\.0-9\^]+)?([\]\d+]+)?$')
+    INSTRUMENT_WORD = re.compile(r'^(\[+)?(\+)?@([a-zA-Z0-9-_]+)([\]\d+]+)?$')
+
     def __init__(self, content, logger, options):
         self.first_run = True
 
@@ -57,18 +151,45 @@ class WarpWhistle(object):
         # list of voices
         self.voices = None
 
+        # where imports are loaded from, a callable taking the file name can be
+        # used instead of the disk by setting import_resolver
+        self.import_directory = '.'
+        self.import_path = options.get('import_path') or []
+        self.import_resolver = None
+
+        # set to an Importer to keep imported files between songs
+        self.importer = None
+
+        # set to a Profiler to time each stage of processing
+        self.profiler = None
+
+        # instrument definition => parsed Instrument, set to a dictionary to
+        # reuse instruments parsed for earlier songs
+        self.instrument_cache = None
+
+        # variable name => compiled pattern, set to a dictionary to reuse
+        # patterns compiled for earlier songs
+        self.variable_patterns = {}
+
+        # turns wav files in dpcm declarations into dmc samples, set to a
+        # DPCMConverter to share one between songs
+        self.dpcm_converter = None
+
+        # where each line of the song being processed was in the source
+        self.line_map = None
+
         self.content = content
         self.logger = logger
         self.options = options
         self.reset()
 
-    def reset(self):
+    def reset(self, counter=0):
+        self.macros = Macros(counter, self.options.get('compress_macros', False))
         self.current_voices = []
         self.global_vars = {}
         self.vars = {}
         self.instruments = {}
         self.data = {}
-        self.global_lines = []
 
     def getDataForVoice(self, voice, key):
         if not voice in self.data:
@@ -105,89 +226,74 @@ class WarpWhistle(object):
         return None
 
     def processImports(self, content):
-        matches = re.findall(r'(@import\s{1,}(\'|\")(.*)(\2))$', content, re.MULTILINE)
+        importer = self.importer if self.importer is not None else Importer()
+        return importer.resolve(content, self, self.line_map)
 
-        for match in matches:
-            filename = match[2] if match[2].endswith('.mmlx') else match[2] + '.mmlx'
-            disk_path = os.path.join(self.import_directory, filename)
-            file_content = Util.openFile(disk_path)
-            content = content.replace(match[0], file_content)
+    def substitute(self, pattern, callback, content, line_map=None):
+        """pattern.sub(callback, content), keeping track of where the lines
+        came from if there is a line map"""
+        if line_map is None:
+            return pattern.sub(callback, content)
 
-        self.logger.log('- stripping comments again', True)
-        content = self.stripComments(content)
+        return line_map.sub(pattern, callback, content)
 
-        if content.find('@import') > 0:
-            content = self.processImports(content)
+    def stripComments(self, content, line_map=None):
+        """removes /* block */, ; and // comments and empty lines in a single pass
 
-        return content
+        anything inside quotes (such as dmc paths or #TITLE values) is left alone.
+        a quote that is not closed on the same line is just a character."""
+        # end of the last token and whether the last thing kept was a new line
+        state = {'position': 0, 'new_line': False}
 
-    def stripComments(self, content):
-        # replace all /* comments */
-        content = re.sub(re.compile(r'(/\*(.*?)\*/)', re.MULTILINE | re.DOTALL), '', content)
+        def replace(match):
+            if match.start() > state['position']:
+                state['new_line'] = False
 
-        # replace all ; comments
-        content = re.sub(re.compile(r' {0,}(;.*)$', re.MULTILINE), '', content)
+            state['position'] = match.end()
+            token = match.group(0)
+            first = token[0]
 
-        # replace all // comments
-        content = re.sub(re.compile(r' {0,}(//.*)$', re.MULTILINE), '', content)
+            if first == '\n':
+                # a run of new lines (even with comments in between) becomes one
+                if state['new_line']:
+                    return ''
 
-        # replace empty lines
-        content = re.sub(re.compile(r'\n{2,}', re.MULTILINE), '\n', content)
+                state['new_line'] = True
+                return '\n'
 
-        return content
+            if first == '"' or first == "'":
+                state['new_line'] = False
+                return token
+
+            return ''
+
+        return self.substitute(WarpWhistle.COMMENT_TOKENS, replace, content, line_map)
 
     def collapseSpaces(self, content):
         # collapse multiple spaces into a single space
-        return re.sub(re.compile(' {2,}', re.MULTILINE), ' ', content)
-
-    def removeBlankLines(self, content):
-        return re.sub(r'\n{2,}', '\n', content)
+        return WarpWhistle.SPACES.sub(' ', content)
 
     def processGlobalVariables(self, content):
-        matches = re.findall(r'(^#([-A-Z0-9]+)( {1,}(.*))?\n)', content, re.MULTILINE)
-        for match in matches:
-            if match[1] == WarpWhistle.TRANSPOSE:
-                self.global_vars[match[1]] = int(match[3]) if match[3] else 0
-            else:
-                self.global_vars[match[1]] = match[3] or True
+        # declarations are all handled in one pass over the song
+        return self.substitute(WarpWhistle.GLOBAL_VARIABLE, self.processGlobalVariable, content, self.line_map)
 
-            if match[1].startswith('X-'):
-                content = content.replace(match[0], '')
-            else:
-                self.global_lines.append(match[0])
+    def processGlobalVariable(self, match):
+        name = match.group(2)
+        value = match.group(4)
+        if name == WarpWhistle.TRANSPOSE:
+            self.global_vars[name] = int(value) if value else 0
+        else:
+            self.global_vars[name] = value or True
 
-            if match[1] == WarpWhistle.COUNTER:
-                Instrument.reset(match[3])
+        if name == WarpWhistle.COUNTER:
+            self.macros.reset(value)
 
-        return content
+        # mmlx's own variables are not passed on to ppmck
+        return '' if name.startswith('X-') else match.group(0)
 
     def isReserved(self, var):
-        # single letter match
-        if re.match(r'^[A-Z]{1,2}$', var):
-            return True
-
-        # volume macro
-        if re.match(r'^v\d+$', var):
-            return True
-
-        # rest
-        if re.match(r'^r\d+$', var):
-            return True
-
-        # wait
-        if re.match(r'^w\d+$', var):
-            return True
-
-        # pitch macro
-        if re.match(r'^EP\d+$', var):
-            return True
-
-        # arpeggio macro
-        if re.match(r'^EN\d+$', var):
-            return True
-
-        # self delay macro
-        if re.match(r'^SD\d+$', var):
+        # voices and single letters, volume, pitch, arpeggio and self delay macros, rests and waits
+        if WarpWhistle.RESERVED_VARIABLE.match(var):
             return True
 
         reserved = ['EPOF', 'ENOF', 'SDOF', 'w', 'r']
@@ -195,17 +301,14 @@ class WarpWhistle(object):
         return var in reserved
 
     def processLocalVariables(self, content):
-        matches = re.findall(r'(^([a-zA-Z]{1}([a-zA-Z0-9_]+)?)\s{0,}=\s{0,}(.*)\n)', content, re.MULTILINE)
-        for match in matches:
+        return self.substitute(WarpWhistle.LOCAL_VARIABLE, self.processLocalVariable, content, self.line_map)
 
-            if self.isReserved(match[1]):
-                raise Exception('variable ' + match[1] + ' is reserved')
+    def processLocalVariable(self, match):
+        if self.isReserved(match.group(2)):
+            raise Exception('variable ' + match.group(2) + ' is reserved')
 
-            self.vars[match[1]] = match[3]
-
-            content = content.replace(match[0], '')
-
-        return content
+        self.vars[match.group(2)] = match.group(4)
+        return ''
 
     def processVariables(self, content):
         content = self.processGlobalVariables(content)
@@ -216,19 +319,29 @@ class WarpWhistle(object):
         if name == 'end':
             raise Exception('end is a reserved word and connt be used for an instrument')
 
+        if self.instrument_cache is not None and content in self.instrument_cache:
+            instrument = copy.copy(self.instrument_cache[content])
+            instrument.registerBuffer(self.macros)
+            self.instruments[name] = instrument
+            return
+
         lines = content.strip().split('\n')
         data = {}
 
         for line in lines:
             line = line.strip()
-            match = re.match(r'^@extends {1,}(\'|\")(.*)(\1)$', line)
+            match = WarpWhistle.EXTENDS_LINE.match(line)
             if match:
                 data["extends"] = match.group(2)
                 continue
 
             data[line.split(':', 1)[0].strip()] = line.split(':', 1)[1].strip()
 
-        self.instruments[name] = Instrument(data)
+        instrument = Instrument(data, self.macros)
+        if self.instrument_cache is not None:
+            self.instrument_cache[content] = copy.copy(instrument)
+
+        self.instruments[name] = instrument
 
     def updateInstruments(self):
         for name in self.instruments:
@@ -237,14 +350,14 @@ class WarpWhistle(object):
                 instrument.inherit(self.instruments[instrument.getParent()])
 
     def processInstruments(self, content):
-        matches = re.findall(r'(^([a-zA-Z0-9-_]+):( {0,}(\n( {4}|\t)(.*))+)\n)', content, re.MULTILINE)
-        for match in matches:
-            self.addInstrument(match[1].lower(), match[2])
-            content = content.replace(match[0], '')
-
+        content = self.substitute(WarpWhistle.INSTRUMENT_BLOCK, self.processInstrument, content, self.line_map)
         self.updateInstruments()
         return content
 
+    def processInstrument(self, match):
+        self.addInstrument(match.group(2).lower(), match.group(3))
+        return ''
+
     def getVoicesForChip(self, chip):
         if chip == WarpWhistle.CHIP_N106:
             return {
@@ -292,29 +405,18 @@ class WarpWhistle(object):
 
     def processExpansionVoices(self, content):
         """finds any special voices (such as N106-AB) and converts them to the proper voice names"""
-        matches = re.findall(r'((N106|FDS|VRC6)-([A-Z]+) )', content)
-        for match in matches:
-            content = content.replace(match[0], self.getVoiceFor(match[1], match[2]) + ' ')
+        # one pass over the song instead of copying all of it for every voice
+        return WarpWhistle.EXPANSION_VOICE.sub(lambda match: self.getVoiceFor(match.group(2), match.group(3)) + ' ', content)
 
-        return content
-
-    def renderTempo(self, content):
+    def renderTempo(self):
         tempo = self.getGlobalVar(WarpWhistle.X_TEMPO)
         if tempo is None:
-            return content
-
-        return self.addToMml(content, "".join(self.voices) + " t" + str(tempo) + "\n")
-
-    def renderInstruments(self, content):
-        if not Instrument.hasBeenUsed():
-            return content
+            return []
 
-        # find the last #BLOCK on the top of the file and render the instruments below it
-        return self.addToMml(content, Instrument.render())
+        return ["".join(self.voices) + " t" + str(tempo)]
 
-    def renderN106(self, content):
-        n106_voices = self.getVoicesForChip(WarpWhistle.CHIP_N106).values()
-        n106_voices.sort()
+    def renderN106(self):
+        n106_voices = sorted(self.getVoicesForChip(WarpWhistle.CHIP_N106).values())
 
         n106_count = 0
         for voice in self.voices:
@@ -322,6 +424,7 @@ class WarpWhistle(object):
                 index = n106_voices.index(voice) + 1
                 n106_count = max(n106_count, index)
 
+        lines = []
         if n106_count > 0:
             # in order to stay on pitch it has to be 1,2,4 or 8
             if n106_count == 3:
@@ -332,13 +435,13 @@ class WarpWhistle(object):
 
             if not WarpWhistle.N106 in self.global_vars:
                 self.global_vars[WarpWhistle.N106] = str(n106_count)
-                content = self.addToMml(content, '#' + WarpWhistle.N106 + ' ' + str(n106_count) + '\n', True)
+                lines.append('#' + WarpWhistle.N106 + ' ' + str(n106_count))
 
             if not WarpWhistle.PITCH_CORRECTION in self.global_vars:
                 self.global_vars[WarpWhistle.PITCH_CORRECTION] = True
-                content = self.addToMml(content, '#' + WarpWhistle.PITCH_CORRECTION + '\n', True)
+                lines.append('#' + WarpWhistle.PITCH_CORRECTION)
 
-        return content
+        return lines
 
     def getExpForChip(self, chip):
         if chip == WarpWhistle.CHIP_N106:
@@ -348,9 +451,8 @@ class WarpWhistle(object):
         elif chip == WarpWhistle.CHIP_VRC6:
             return WarpWhistle.VRC6
 
-    def renderForChip(self, chip, content):
-        chip_voices = self.getVoicesForChip(chip).values()
-        chip_voices.sort()
+    def renderForChip(self, chip):
+        chip_voices = sorted(self.getVoicesForChip(chip).values())
 
         used = False
         for voice in self.voices:
@@ -361,35 +463,68 @@ class WarpWhistle(object):
         exp = self.getExpForChip(chip)
         if used and not exp in self.global_vars:
             self.global_vars[exp] = True
-            content = self.addToMml(content, '#' + exp + '\n', True)
+            return ['#' + exp]
 
-        return content
+        return []
 
-    def renderExpansionChips(self, content):
-        content = self.renderN106(content)
-        content = self.renderForChip(WarpWhistle.CHIP_FDS, content)
-        content = self.renderForChip(WarpWhistle.CHIP_VRC6, content)
+    def renderExpansionChips(self):
+        lines = self.renderN106()
+        lines += self.renderForChip(WarpWhistle.CHIP_FDS)
+        lines += self.renderForChip(WarpWhistle.CHIP_VRC6)
 
-        return content
+        return lines
+
+    def findEndOfPreamble(self, content):
+        """returns where the line after the last global declaration starts
 
-    def addToMml(self, content, string, is_global_line=False):
-        try:
-            last_global_declaration = self.global_lines[-1]
-        except:
-            # if there are no global lines then prepend
-            return string + content
+        anything rendered into the header (expansion chips, macros, tempo) goes there"""
+        end = 0
+        for match in WarpWhistle.GLOBAL_LINE.finditer(content):
+            end = match.end() + 1
 
-        if is_global_line:
-            self.global_lines.append(string)
+        return end
 
-        return content.replace(last_global_declaration, last_global_declaration + string)
+    def iterLines(self, content, start=0, end=None):
+        """yields the lines of content between start and end one at a time
+        instead of splitting all of it into a list"""
+        if end is None:
+            end = len(content) + 1
+
+        while start < end:
+            position = content.find('\n', start, end)
+            if position < 0:
+                position = min(end, len(content))
+
+            yield content[start:position]
+            start = position + 1
 
     def replaceVariables(self, content):
-        for key in self.vars:
-            pattern = '((?<=\s)|(?<=\[))' + key + '(?=\s|\Z|\])'
-            content = re.sub(re.compile(pattern, re.MULTILINE), self.vars[key], content)
+        """replaces every variable in one pass over the song
 
-        return content
+        variables are applied in the order they were declared, so a variable
+        used in the value of one declared before it gets replaced too.  that
+        is worked out on the values up front"""
+        if not len(self.vars):
+            return content
+
+        keys = list(self.vars)
+        values = {}
+        for key, name in enumerate(keys):
+            value = ' ' + self.vars[name] + ' '
+            for later in keys[key + 1:]:
+                if later in value:
+                    value = self.getVariablePattern(later).sub(self.vars[later], value)
+
+            values[name] = value[1:-1]
+
+        pattern = re.compile(WarpWhistle.VARIABLE_USE % ('(' + '|'.join(keys) + ')'), re.MULTILINE)
+        return pattern.sub(lambda match: values[match.group(2)], content)
+
+    def getVariablePattern(self, key):
+        if not key in self.variable_patterns:
+            self.variable_patterns[key] = re.compile(WarpWhistle.VARIABLE_USE % key, re.MULTILINE)
+
+        return self.variable_patterns[key]
 
     def isUndefinedVariable(self, var):
         return False
@@ -407,43 +542,10 @@ class WarpWhistle(object):
         return symbol * ticks
 
     def getNumberForNote(self):
-        return {
-            'c': 0,
-            'c+': 1,
-            'd-': 1,
-            'd': 2,
-            'd+': 3,
-            'e-': 3,
-            'e': 4,
-            'f-': 4,
-            'e+': 5,
-            'f': 5,
-            'f+': 6,
-            'g-': 6,
-            'g': 7,
-            'g+': 8,
-            'a-': 8,
-            'a': 9,
-            'a+': 10,
-            'b-': 10,
-            'b': 11
-        }
+        return WarpWhistle.NOTE_NUMBERS
 
     def getNoteForNumber(self):
-        return {
-            0: 'c',
-            1: 'c+',
-            2: 'd',
-            3: 'd+',
-            4: 'e',
-            5: 'f',
-            6: 'f+',
-            7: 'g',
-            8: 'g+',
-            9: 'a',
-            10: 'a+',
-            11: 'b'
-        }
+        return WarpWhistle.NUMBER_NOTES
 
     def isNoiseChannel(self):
         return self.current_voices[0] == 'D'
@@ -464,7 +566,7 @@ class WarpWhistle(object):
             0x038A
         ]
 
-        index = self.getNumberForNote()[note]
+        index = WarpWhistle.NOTE_NUMBERS[note]
         frequency = frequencies[index] >> (octave - 2)
         return frequency
 
@@ -488,6 +590,9 @@ class WarpWhistle(object):
         return shift[number]
 
     def slide(self, start_data, end_data):
+        if self.profiler is not None:
+            self.profiler.count('slides computed')
+
         N106_channels = self.getGlobalVar(WarpWhistle.N106)
         shift = 0
         if N106_channels is not None and len(N106_channels):
@@ -500,7 +605,7 @@ class WarpWhistle(object):
 
             shift = self.calculateN106OctaveShift(int(N106_channels), waveform)
 
-        match = re.match(r'^(\[+)?([a-g](\+|\-)?)(.*)$', start_data['note'])
+        match = WarpWhistle.SLIDE_START.match(start_data['note'])
         start_data['note'] = match.group(2)
         start_data['append'] = match.group(4)
 
@@ -549,14 +654,14 @@ class WarpWhistle(object):
             'pitch': pitch_macro
         })
 
-        macro = instrument.getPitchMacro()
+        macro = instrument.getPitchMacro(self.macros)
 
         # no longer need to slide
         self.setDataForVoices(self.current_voices, WarpWhistle.SLIDE, None)
 
         append_before = end_data['append']
         append_after = ''
-        match = re.match(r'(.*)(\](.*))', end_data['append'])
+        match = WarpWhistle.SLIDE_END.match(end_data['append'])
         if match:
 
             if match.group(1):
@@ -582,58 +687,136 @@ class WarpWhistle(object):
                 smooth_start = ' SM '
                 smooth_end = ' SMOF'
 
-        return self.getOctaveShift(octave_diff) + smooth_start + macro + ' ' + start_data['note'] + append_before + ' EPOF' + smooth_end + append_after + ' ' + self.getOctaveShift(-octave_diff)
+        return f"{self.getOctaveShift(octave_diff)}{smooth_start}{macro} {start_data['note']}{append_before} EPOF{smooth_end}{append_after} {self.getOctaveShift(-octave_diff)}"
 
     def getOctaveShift(self, ticks):
         char = '<' if ticks < 0 else '>'
         return abs(ticks) * char
 
+    def getTranspose(self):
+        """semitones to transpose the current voices by, X-TRANSPOSE plus the voice's own (KT-2)"""
+        return self.getGlobalVar(WarpWhistle.TRANSPOSE) + (self.getDataForVoice(self.current_voices[0], WarpWhistle.VOICE_TRANSPOSE) or 0)
+
+    def moveOctaveOffset(self, offset):
+        """returns the shift to put the output offset octaves away from the octave written
+
+        transposing can move a note into the next octave.  instead of moving
+        there and back for every note the output stays in that octave until a
+        note needs a different one."""
+        if not len(self.current_voices):
+            return ''
+
+        current = self.getDataForVoice(self.current_voices[0], WarpWhistle.OCTAVE_OFFSET) or 0
+        self.setDataForVoices(self.current_voices, WarpWhistle.OCTAVE_OFFSET, offset)
+        return self.getOctaveShift(offset - current)
+
+    def restoreOctave(self):
+        return self.moveOctaveOffset(0)
+
+    def startLoops(self, count):
+        """remembers the octave at the start of loops"""
+        octaves = list(self.getDataForVoice(self.current_voices[0], WarpWhistle.LOOP_OCTAVES) or [])
+        octaves += [self.getDataForVoice(self.current_voices[0], WarpWhistle.OCTAVE)] * count
+        self.setDataForVoices(self.current_voices, WarpWhistle.LOOP_OCTAVES, octaves)
+
+    def endLoop(self):
+        """returns the shift back to the octave the loop ending here started in
+
+        a transposed note can leave the output in another octave and with
+        X-ABSOLUTE-NOTES the notes in a loop can move away from the octave the
+        loop started in.  either way the next time around would be off."""
+        ticks = -(self.getDataForVoice(self.current_voices[0], WarpWhistle.OCTAVE_OFFSET) or 0)
+        self.setDataForVoices(self.current_voices, WarpWhistle.OCTAVE_OFFSET, 0)
+
+        octaves = list(self.getDataForVoice(self.current_voices[0], WarpWhistle.LOOP_OCTAVES) or [])
+        if not len(octaves):
+            return self.getOctaveShift(ticks)
+
+        start = octaves.pop()
+        self.setDataForVoices(self.current_voices, WarpWhistle.LOOP_OCTAVES, octaves)
+
+        current = self.getDataForVoice(self.current_voices[0], WarpWhistle.OCTAVE)
+        if self.getGlobalVar(WarpWhistle.ABSOLUTE_NOTES) and start is not None and current is not None:
+            ticks += start - current
+            self.setDataForVoices(self.current_voices, WarpWhistle.OCTAVE, start)
+
+        return self.getOctaveShift(ticks)
+
+    def endLoops(self, ends):
+        """returns the ends of loops (]4]2) with the shift back to the right octave in front of each one"""
+        new_ends = ''
+        for end in WarpWhistle.LOOP_END.findall(ends):
+            shift = self.endLoop()
+            new_ends += f' {shift} {end}' if shift else end
+
+        return new_ends
+
+    def isNoteWord(self, word):
+        return WarpWhistle.NOTE_WORD.match(word) is not None or WarpWhistle.ABSOLUTE_NOTE_WORD.match(word) is not None
+
+    def getLoopShift(self, word):
+        """returns the shift to put in front of a word so it is in the octave that was written
+
+        the output goes back to the octave written before loops, voices and the
+        end of a line.  notes that end a loop (c8]2) take care of it themselves."""
+        if self.isNoteWord(word):
+            return self.restoreOctave() if word.startswith('[') else ''
+
+        if ']' in word:
+            shift = ''.join([self.endLoop() for end in range(word.count(']'))])
+            return self.getOctaveShift(shift.count('>') - shift.count('<'))
+
+        if WarpWhistle.LOOP_MARKER.search(word) or WarpWhistle.VOICE_WORD.match(word):
+            return self.restoreOctave()
+
+        return ''
+
     def transposeNote(self, note, octave, amount, append):
         if append is None:
             append = ''
 
         start_data = self.getDataForVoice(self.current_voices[0], WarpWhistle.SLIDE)
 
-        new_note = ''
-        if amount == 0 or self.isNoiseChannel():
-            if start_data:
-                return self.slide(start_data, {'note': note, 'append': append, 'octave': octave})
+        if (amount == 0 or self.isNoiseChannel()) and start_data:
+            return self.slide(start_data, {'note': note, 'append': append, 'octave': octave})
 
-            return note + append
+        ends = ''
+        if ']' in append:
+            ends = append[append.find(']'):]
+            append = append[:append.find(']')]
 
-        new_note_number = self.getNumberForNote()[note] + amount
+        if amount == 0 or self.isNoiseChannel():
+            return note + append + self.endLoops(ends)
+
+        new_note_number = WarpWhistle.NOTE_NUMBERS[note] + amount
 
-        ticks = 0
-        while new_note_number < 0:
-            new_note += '< '
-            ticks += 1
-            new_note_number = new_note_number + 12
+        # c transposed down by 2 is a+ in the octave below
+        shift = self.moveOctaveOffset(new_note_number // 12)
+        new_note = WarpWhistle.NUMBER_NOTES[new_note_number % 12]
 
-        while new_note_number > 11:
-            ticks -= 1
-            new_note += '> '
-            new_note_number = new_note_number - 12
+        if shift:
+            return f'{shift} {new_note}{append}{self.endLoops(ends)}'
 
-        note_name = self.getNoteForNumber()[new_note_number]
-        new_note += note_name
-        new_note += append + ' ' + self.getOctaveShift(ticks)
+        return f'{new_note}{append}{self.endLoops(ends)}'
 
-        return new_note
+    def countMatch(self, branch):
+        if self.profiler is not None:
+            self.profiler.count(f'processWord: {branch}')
 
     def processWord(self, word, next_word, prev_word):
         if not word:
             return word
 
-        valid_commands = ['EPOF', 'ENOF', 'MPOF', 'PS', 'SDQR', 'SDOF', 'MHOF', 'SM', 'SMOF', 'EHOF']
-        if word in valid_commands:
+        if word in WarpWhistle.COMMANDS:
+            self.countMatch('command')
             if self.ignore:
                 return ""
 
             return word
 
         # matches a voice declaration
-        if re.match(r'[A-Z]{1,}$', word):
-
+        if WarpWhistle.VOICE_WORD.match(word):
+            self.countMatch('voice')
             self.current_voices = list(word)
 
             # processing everything, keep going
@@ -651,12 +834,25 @@ class WarpWhistle(object):
             return ""
 
         if self.ignore:
+            self.countMatch('ignored')
             return ""
 
-        # slides for portamento
-        match = re.match(r'^\/([0-9]+)?$', word)
+        # notes are most of the words in a song and nothing before the notes can match them
+        if word[0] in WarpWhistle.NOTE_STARTS:
+            return self.processNote(word)
+
+        # transpose for the current voices from here on (KT-2 or KT+5), on top of X-TRANSPOSE,
+        # ppmck's own K transpose is left for ppmckc
+        match = WarpWhistle.TRANSPOSE_WORD.match(word)
         if match:
+            self.countMatch('transpose')
+            self.setDataForVoices(self.current_voices, WarpWhistle.VOICE_TRANSPOSE, int(match.group(1)))
+            return ''
 
+        # slides for portamento
+        match = WarpWhistle.SLIDE_WORD.match(word)
+        if match:
+            self.countMatch('slide')
             # calculate the previous note
             prev_note = self.processWord(prev_word, None, None)
 
@@ -668,47 +864,57 @@ class WarpWhistle(object):
             return ''
 
         # matches a tempo declaration
-        if re.match(r't\d+$', word):
+        if WarpWhistle.TEMPO_WORD.match(word):
+            self.countMatch('tempo')
             self.setDataForVoices(self.current_voices, WarpWhistle.TEMPO, int(word[1:]))
             return word
 
         # volume change
-        if re.match(r'@v\d+$', word) and next != '=':
+        if WarpWhistle.VOLUME_WORD.match(word) and next != '=':
+            self.countMatch('volume')
             self.setDataForVoices(self.current_voices, WarpWhistle.VOLUME, int(word[2:]))
             return word
 
         # timbre change
-        if re.match(r'@@\d+$', word):
+        if WarpWhistle.TIMBRE_WORD.match(word):
+            self.countMatch('timbre')
             self.setDataForVoices(self.current_voices, WarpWhistle.TIMBRE, int(word[2:]))
             return word
 
         # arpeggio change
-        if re.match(r'EN\d+$', word):
+        if WarpWhistle.ARPEGGIO_WORD.match(word):
+            self.countMatch('arpeggio')
             self.setDataForVoices(self.current_voices, WarpWhistle.ARPEGGIO, int(word[2:]))
             return word
 
         # pitch change
-        if re.match(r'EP\d+$', word):
+        if WarpWhistle.PITCH_WORD.match(word):
+            self.countMatch('pitch')
             self.setDataForVoices(self.current_voices, WarpWhistle.PITCH, int(word[2:]))
             return word
 
         # q change
-        if re.match(r'q[0-8]$', word):
+        if WarpWhistle.Q_WORD.match(word):
+            self.countMatch('q')
             self.setDataForVoices(self.current_voices, WarpWhistle.Q, int(word[1:]))
             return word
 
         # direct timbre
-        if re.match(r'@\d+$', word):
+        if WarpWhistle.DIRECT_TIMBRE_WORD.match(word):
+            self.countMatch('direct timbre')
             self.setDataForVoices(self.current_voices, WarpWhistle.TIMBRE, int(word[1:]))
             return word
 
         # explicit octave change (with o4 o3 etc)
-        if re.match(r'o\d+$', word):
+        if WarpWhistle.OCTAVE_WORD.match(word):
+            self.countMatch('octave')
             self.setDataForVoices(self.current_voices, WarpWhistle.OCTAVE, int(word[1:]))
+            self.setDataForVoices(self.current_voices, WarpWhistle.OCTAVE_OFFSET, 0)
             return word
 
         # octave change with > or < or >>>
-        if re.match(r'\>+|\<+$', word):
+        if WarpWhistle.OCTAVE_SHIFT_WORD.match(word):
+            self.countMatch('octave shift')
             direction = word[0]
             count = len(word)
             current_octave = self.getDataForVoice(self.current_voices[0], WarpWhistle.OCTAVE)
@@ -721,23 +927,57 @@ class WarpWhistle(object):
             return word
 
         # dmc declaration
-        match = re.match(r'(\{\s{0,})?(\'|\")(.*\.dmc)(\2)\s{0,},', word)
+        match = WarpWhistle.DMC_WORD.match(word)
         if match:
-            mmlx_dir = self.options['start'] if os.path.isdir(self.options['start']) else os.path.dirname(self.options['start'])
-            new_path = os.path.join(mmlx_dir, match.group(3))
+            self.countMatch('dmc')
+            # samples are relative to the song (which may be in a directory inside the one being built).
+            # ppmckc runs in a scratch directory so the path has to be absolute
+            new_path = os.path.abspath(os.path.join(self.import_directory, match.group(3)))
+
+            # the rate can be in the same word ({"kick.wav",15}) or the next one
+            rest = word[match.end():]
+            if match.group(4) == 'wav':
+                new_path = self.convertToDPCM(new_path, rest or next_word)
+
             new_word = ''
 
             if match.group(1):
                 new_word += match.group(1)
 
-            new_word += match.group(2) + new_path + match.group(2) + ','
+            new_word += match.group(2) + new_path + match.group(2) + ',' + rest
 
             return new_word
 
+        return self.processNote(word)
+
+    def getDPCMConverter(self):
+        if self.dpcm_converter is None:
+            from .dpcmconverter import DPCMConverter
+            self.dpcm_converter = DPCMConverter(self.options.get('dpcm_cache'), self.logger)
+
+        return self.dpcm_converter
+
+    def convertToDPCM(self, path, rate_word):
+        """returns the path of the dmc sample for a wav file played at the
+        rate that follows it in the declaration"""
+        match = WarpWhistle.DMC_RATE.match(rate_word or '')
+        converter = self.getDPCMConverter()
+        converted = converter.converted
+
+        dmc_path = converter.convert(path, int(match.group(0)) if match else None)
+
+        if self.profiler is not None:
+            self.profiler.count('dpcm samples converted' if converter.converted > converted else 'dpcm samples cached')
+
+        return dmc_path
+
+    def processNote(self, word):
+        """processes notes and instruments and anything else that is passed through as it is"""
         # rewrite special voices for mmlx such as c4 or G+,4^8
         # to use this put the line X-ABSOLUTE-NOTES at the top of your mmlx file
-        match = re.match(r'(\[+)?([A-Ga-g]{1})(\+|\-)?(\d{1,2})?(,(\d+\.?)(\^[0-9\^]+)?)?([\]\d]+)?$', word)
+        match = WarpWhistle.ABSOLUTE_NOTE_WORD.match(word)
         if match and self.getGlobalVar(WarpWhistle.ABSOLUTE_NOTES):
+            self.countMatch('absolute note')
             is_noise_channel = self.current_voices[0] == 'D'
 
             if is_noise_channel and not "," in word:
@@ -751,6 +991,7 @@ class WarpWhistle(object):
 
             if current_octave is None and not is_noise_channel:
                 new_word += 'o' + octave + ' '
+                self.setDataForVoices(self.current_voices, WarpWhistle.OCTAVE_OFFSET, 0)
             elif not is_noise_channel and octave and int(octave) != current_octave:
                 new_word += self.moveToOctave(int(octave), current_octave) + ' '
 
@@ -761,6 +1002,7 @@ class WarpWhistle(object):
             # [[[
             if match.group(1):
                 new_word += match.group(1)
+                self.startLoops(len(match.group(1)))
 
             note = ""
 
@@ -785,13 +1027,14 @@ class WarpWhistle(object):
             if match.group(8):
                 append += match.group(8)
 
-            new_word += self.transposeNote(note, current_octave, self.getGlobalVar(WarpWhistle.TRANSPOSE), append)
+            new_word += self.transposeNote(note, current_octave, self.getTranspose(), append)
 
             return new_word
 
         # regular note
-        match = re.match(r'(\[+)?([a-g]{1}(\+|\-)?)([\.0-9\^]+)?([\]\d+]+)?$', word)
+        match = WarpWhistle.NOTE_WORD.match(word)
         if match:
+            self.countMatch('note')
             if "," in word and not self.getGlobalVar(WarpWhistle.ABSOLUTE_NOTES):
                 raise Exception('In order to use absolute notes you have to specify X-ABSOLUTE-NOTES')
 
@@ -800,6 +1043,7 @@ class WarpWhistle(object):
             new_note = ""
             if match.group(1):
                 new_note += match.group(1)
+                self.startLoops(len(match.group(1)))
 
             append = ''
             if match.group(4):
@@ -808,14 +1052,14 @@ class WarpWhistle(object):
             if match.group(5):
                 append += match.group(5)
 
-            new_note += self.transposeNote(match.group(2), current_octave, self.getGlobalVar(WarpWhistle.TRANSPOSE), append)
+            new_note += self.transposeNote(match.group(2), current_octave, self.getTranspose(), append)
 
             return new_note
 
         # instrument
-        match = re.match(r'^(\[+)?(\+)?@([a-zA-Z0-9-_]+)([\]\d+]+)?$', word)
+        match = WarpWhistle.INSTRUMENT_WORD.match(word)
         if match:
-
+            self.countMatch('instrument')
             new_word = ''
 
             # special case if you do @end you can end the currently active instruments
@@ -874,6 +1118,8 @@ class WarpWhistle(object):
         if self.isUndefinedVariable(word):
             raise Exception('variable ' + word + ' is undefined')
 
+        self.countMatch('other')
+
         # print "PROCESS:",word
         # print "PREV:",prev_word
         # print "NEXT:",next_word
@@ -886,6 +1132,9 @@ class WarpWhistle(object):
         words = line.split(' ')
         new_words = []
 
+        if self.profiler is not None:
+            self.profiler.count('words processed', len(words))
+
         for key, word in enumerate(words):
             next_word = None
             prev_word = None
@@ -896,48 +1145,70 @@ class WarpWhistle(object):
             if len(words) > key - 1:
                 prev_word = words[key - 1]
 
+            shift = self.getLoopShift(word) if len(self.current_voices) else ''
+            if shift:
+                new_words.append(shift)
+
             new_words.append(self.processWord(word, next_word, prev_word))
 
-        return ' '.join(new_words)
+            # notes start their own loops since they can move the octave before the [
+            if '[' in word and len(self.current_voices) and not self.isNoteWord(word):
+                self.startLoops(word.count('['))
+
+        shift = self.restoreOctave()
+        if shift:
+            new_words.append(shift)
 
-    def findVoices(self, content):
-        matches = re.findall(r'^([A-Z]{1,}) ', content, re.MULTILINE)
+        return ' '.join(new_words)
 
+    def findVoices(self, lines):
         voices = []
-        for match in matches:
-            new_voices = list(match)
-            for voice in new_voices:
+        for line in lines:
+            match = WarpWhistle.VOICE_DECLARATION.match(line)
+
+            # N106-AB and the like only turn into voices once they are converted
+            if match is None and line[:1].isupper():
+                match = WarpWhistle.VOICE_DECLARATION.match(self.prepareLine(line))
+
+            if match is None:
+                continue
+
+            for voice in match.group(1):
                 if not voice in voices:
                     voices.append(voice)
 
         return voices
 
+    def startStage(self, name):
+        self.logger.debug('- %s', name)
+        if self.profiler is not None:
+            self.profiler.stage(name)
+
     def process(self, content):
-        self.logger.log('- stripping comments', True)
-        content = self.stripComments(content)
+        self.line_map = LineMap(content)
 
-        self.logger.log('- proccessing imports', True)
+        self.startStage('stripping comments')
+        content = self.stripComments(content, self.line_map)
+
+        self.startStage('processing imports')
         content = self.processImports(content)
 
-        self.logger.log('- parsing variables', True)
+        self.startStage('parsing variables')
         content = self.processVariables(content)
 
-        self.logger.log('- applying variables', True)
+        self.startStage('applying variables')
         content = self.replaceVariables(content)
 
-        self.logger.log('- parsing instruments', True)
+        self.startStage('parsing instruments')
         content = self.processInstruments(content)
 
-        self.logger.log('- collapsing spaces', True)
-        content = self.collapseSpaces(content)
-
-        self.logger.log('- processing expansion voices', True)
-        content = self.processExpansionVoices(content)
-
-        self.voices = self.findVoices(content)
-        content = self.renderTempo(content)
-
-        content = self.renderExpansionChips(content)
+        # spaces are collapsed and expansion voices converted one line at a
+        # time as the lines are streamed (see prepareLines) so neither makes
+        # another copy of the song
+        self.startStage('rendering header')
+        self.voices = self.findVoices(self.iterLines(content))
+        tempo_lines = self.renderTempo()
+        global_lines = self.renderExpansionChips()
 
         if not self.first_run:
             if self.voices_to_process is None:
@@ -947,32 +1218,97 @@ class WarpWhistle(object):
                 self.process_voice = self.voices_to_process.pop(0)
 
         if self.process_voice:
-            self.logger.log('processing voice: ' + self.process_voice, True)
+            self.logger.debug('processing voice: %s', self.process_voice)
+
+        preamble_end = self.findEndOfPreamble(content)
+
+        # lines are processed in the order they appear in the final document
+        # since processing a line can change the state for the following lines.
+        # they are streamed one at a time from the content to the emitter
+        self.startStage('processing lines')
+        emitter = Emitter()
+        self.emitLines(emitter, Emitter.PREAMBLE, self.prepareLines(self.iterLines(content, 0, preamble_end)), 0)
+        self.emitLines(emitter, Emitter.GLOBALS, global_lines)
+        self.emitLines(emitter, Emitter.TEMPO, tempo_lines)
+        self.emitBody(emitter, content, preamble_end)
+
+        self.startStage('rendering instruments')
+        self.renderInstruments(emitter)
+
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler.count('macros created', self.macros.getCount())
+            self.profiler.count('macros deduplicated', self.macros.deduplicated)
+
+        self.first_run = False
+
+        return emitter
+
+    def renderInstruments(self, emitter):
+        if not self.macros.hasBeenUsed():
+            return
 
-        lines = content.split('\n')
-        new_lines = []
+        for line in self.macros.renderLines():
+            emitter.addLine(Emitter.MACROS, self.finishLine(line))
+
+        for macro in self.macros.compressed:
+            self.logger.debug('- compressed %s from %d to %d bytes', macro[0], macro[1], macro[2])
+
+        if self.profiler is not None and self.macros.compress:
+            self.profiler.count('macro bytes saved', self.macros.getBytesSaved())
+
+    def prepareLine(self, line):
+        """collapses spaces and converts expansion voices on a line of the song"""
+        return self.processExpansionVoices(self.collapseSpaces(line))
+
+    def prepareLines(self, lines):
         for line in lines:
-            new_lines.append(self.processLine(line))
+            yield self.prepareLine(line)
 
-        content = '\n'.join(new_lines)
+    def processLines(self, lines):
+        for line in lines:
+            yield self.processLine(line)
 
-        content = self.renderInstruments(content)
+    def finishLines(self, lines):
+        for line in lines:
+            yield self.finishLine(line)
 
-        self.logger.log('- replacing unneccessary octave shifts', True)
-        patterns = ['><', '> <', '<>', '< >']
-        for pattern in patterns:
-            while content.find(pattern) > 0:
-                content = content.replace(pattern, '')
+    def getSourceLine(self, line):
+        """returns the line in the source a line of the song came from (or 0)"""
+        if self.line_map is None:
+            return 0
 
-        self.logger.log('- replacing extra spaces', True)
-        content = self.collapseSpaces(content)
+        return self.line_map.getSourceLine(line) or 0
 
-        self.logger.log('- removing blank lines', True)
-        content = self.removeBlankLines(content)
+    def emitLines(self, emitter, section, lines, first_line=None):
+        """runs the lines through each stage and into the emitter one line at a time
 
-        self.first_run = False
+        first_line is the line of the song the lines start on, the emitter
+        keeps the source line for each of them when it is given"""
+        for key, line in enumerate(self.finishLines(self.processLines(lines))):
+            # blank lines are not needed
+            if line.strip():
+                emitter.addLine(section, line, 0 if first_line is None else self.getSourceLine(first_line + key))
 
-        return content
+    def emitBody(self, emitter, content, start):
+        """processes the body (content from start on), in worker processes for
+        each group of voices if parallel_voices is more than 1"""
+        processes = self.options.get('parallel_voices') or 1
+        if processes > 1 and self.process_voice is None:
+            from .voicepool import VoicePool
+
+            if VoicePool(self, processes).emitLines(emitter, Emitter.BODY, content, start):
+                return
+
+        self.emitLines(emitter, Emitter.BODY, self.prepareLines(self.iterLines(content, start)), content.count('\n', 0, start))
+
+    def finishLine(self, line):
+        # replace unneccessary octave shifts
+        for pattern in WarpWhistle.OCTAVE_SHIFTS:
+            while line.find(pattern) >= 0:
+                line = line.replace(pattern, '')
+
+        return self.collapseSpaces(line)
 
     def isPlaying(self):
         if self.first_run:
@@ -983,8 +1319,14 @@ class WarpWhistle(object):
 
         return self.voices_to_process is None or len(self.voices_to_process) != 0
 
-    def play(self):
+    def record(self):
+        """processes the next song and returns a tuple of the emitter and the voice processed"""
         counter = self.getGlobalVar(WarpWhistle.COUNTER) or 0
-        Instrument.reset(counter)
-        self.reset()
+        self.reset(counter)
         return (self.process(self.content), self.process_voice)
+
+    def play(self):
+        song = self.record()
+        content = song[0].getvalue()
+        song[0].close()
+        return (content, song[1])
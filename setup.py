@@ -1,6 +1,6 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name = 'mmlx',
@@ -12,6 +12,7 @@ setup(
     url = 'https://github.com/ccampbell/mmlx',
     download_url = 'https://github.com/ccampbell/mmlx/zipball/1.0.2',
     license = 'Apache Software License',
+    python_requires = '>=3.6',
     packages = ['mmlxlib'],
     package_data = {'mmlxlib': ['nes_include/ppmck.asm', 'nes_include/ppmck/*']},
     scripts = ['bin/mmlx', 'bin/ppmckc', 'bin/nesasm']